@@ -0,0 +1,287 @@
+# Micro-benchmarks for the tracker's hot paths.
+#   python benchmarks.py parse [--google page.html] [--yahoo page.html] [--repeat N]
+#   python benchmarks.py startup [--page News] [--top N]
+#   python benchmarks.py format [--rows N] [--repeat N]
+#   python benchmarks.py classify [--feed feed.xml] [--headlines N] [--symbols N]
+# Without saved pages, synthetic pages shaped like the real ones are used.
+import argparse
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from io import StringIO
+
+
+def synthetic_google_page(filler_blocks=4000):
+    filler = "".join(
+        f'<div class="gyFHrc"><span class="mfs7Fc">Metric {i}</span><div class="P6K39c">{i * 1.5:,.2f}</div></div>'
+        for i in range(filler_blocks)
+    )
+    script = "<script>" + "var x=1;" * 20000 + "</script>"
+    return (
+        "<html><head><title>Apple Inc (AAPL) Stock Price</title>" + script + "</head><body>"
+        '<div class="zzDege">Apple Inc</div><div class="YMlKec fxKbKc">$1,234.56</div>'
+        + filler + "</body></html>"
+    )
+
+
+def synthetic_yahoo_page(rows=100, filler_blocks=4000):
+    header = "".join(f"<th>{h}</th>" for h in ["", "Symbol", "Name", "Price", "Change", "Change %", "Volume", "Market Cap"])
+    body = "".join(
+        f"<tr><td><input type='checkbox'></td><td><a href='/quote/T{i}'>T{i}</a></td><td>Company {i} Inc.</td>"
+        f"<td>{100 + i:,.2f}</td><td>+{i / 10:.2f}</td><td>+{i / 7:.2f}%</td><td>{i * 1_000_000:,}</td><td>{i * 1.1:.3f}B</td></tr>"
+        for i in range(rows)
+    )
+    filler = "".join(f'<section class="card"><p>Story {i}</p><a href="/news/{i}">Read</a></section>' for i in range(filler_blocks))
+    script = "<script>" + "window.__data={};" * 20000 + "</script>"
+    return f"<html><head>{script}</head><body>{filler}<table><thead><tr>{header}</tr></thead><tbody>{body}</tbody></table></body></html>"
+
+
+def bs4_google(text):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(text, "html.parser")
+    price = soup.find("div", class_="YMlKec fxKbKc")
+    name = soup.find("div", class_="zzDege")
+    close_val = float(price.text.replace(",", "").replace("$", "")) if price else None
+    return close_val, name.text.strip() if name else ''
+
+
+def bs4_yahoo(text):
+    import pandas as pd
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(text, "html.parser")
+    table = soup.find('table')
+    return pd.read_html(StringIO(str(table)))[0].head(15)
+
+
+def measure(func, text, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    func(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def bench_parse(args):
+    import pandas as pd
+    from tradebox_stock_tracker import parse_google_quote, parse_yahoo_table
+
+    pages = {
+        "google": open(args.google, encoding="utf-8").read() if args.google else synthetic_google_page(),
+        "yahoo": open(args.yahoo, encoding="utf-8").read() if args.yahoo else synthetic_yahoo_page(),
+    }
+    cases = {
+        "google": (bs4_google, parse_google_quote),
+        "yahoo": (bs4_yahoo, lambda text: parse_yahoo_table(text, max_rows=15)),
+    }
+    print(f"{'page':<8}{'size':>10}{'parser':>8}{'best ms':>10}{'peak MB':>10}")
+    for page, (baseline, fast) in cases.items():
+        text = pages[page]
+        for label, func in (("bs4", baseline), ("lxml", fast)):
+            best, peak = measure(func, text, args.repeat)
+            print(f"{page:<8}{len(text) / 1024:>8.0f}KB{label:>8}{best * 1000:>10.2f}{peak / 2**20:>10.2f}")
+        if page == "google":
+            assert baseline(text) == fast(text), "parsers disagree on the Google page"
+        else:
+            pd.testing.assert_frame_equal(baseline(text), fast(text), check_dtype=False)
+    print("peak MB is Python-heap only (tracemalloc); lxml's libxml2 tree is C memory freed with the document")
+
+
+def cellwise_format_movers(df):
+    # The per-cell formatting/styling the movers table used before TABLE FORMATTING
+    df = df.reset_index(drop=True).drop(columns=['Unnamed: 0'], errors='ignore')
+
+    def fmt_compact(val, units):
+        try:
+            v = float(str(val).replace(',', ''))
+            for scale, unit in ((1e9, "B"), (1e6, "M"), (1e3, "K")):
+                if unit in units and v >= scale:
+                    return f"{v / scale:.2f}{unit}"
+            return f"{v:.0f}"
+        except ValueError:
+            return val
+
+    def color_mover(val):
+        try:
+            v = float(str(val).replace('%', '').replace(',', ''))
+            if v > 0:
+                return 'color: #188038; font-weight: bold;'
+            elif v < 0:
+                return 'color: #d93025; font-weight: bold;'
+        except ValueError:
+            pass
+        return ''
+
+    for col in df.columns:
+        if any(x in col.lower() for x in ['price', 'change', 'close', 'open', 'low', 'high']):
+            df[col] = df[col].apply(lambda x: f"{float(str(x).replace(',', '')):,.2f}" if str(x).replace('.', '', 1).replace('-', '', 1).replace(',', '').replace('%', '').isdigit() else x)
+        if 'volume' in col.lower():
+            df[col] = df[col].apply(fmt_compact, units="BMK")
+        if 'market cap' in col.lower():
+            df[col] = df[col].apply(fmt_compact, units="BM")
+    return df, lambda: df.style.map(color_mover, subset=['Change %'])._compute()
+
+
+def vectorized_format_movers(df):
+    from tradebox_stock_tracker import format_movers_table, style_pnl
+    df = format_movers_table(df)
+    return df, lambda: style_pnl(df, ['Change %'])._compute()
+
+
+def bench_format(args):
+    from tradebox_stock_tracker import parse_yahoo_table
+    df = parse_yahoo_table(synthetic_yahoo_page(rows=args.rows, filler_blocks=1))
+    print(f"{'rows':>6}{'formatter':>12}{'format ms':>11}{'style ms':>10}")
+    for label, func in (("cellwise", cellwise_format_movers), ("vectorized", vectorized_format_movers)):
+        format_best, _ = measure(func, df, args.repeat)
+        style_best, _ = measure(lambda _: func(df)[1](), None, args.repeat)
+        print(f"{len(df):>6}{label:>12}{format_best * 1000:>11.2f}{(style_best - format_best) * 1000:>10.2f}")
+    print("style ms is pandas Styler computing the colour map (what st.dataframe renders from)")
+
+
+def substring_category(title):
+    # get_category before NEWS TAGGING: substring checks, so "ai" also matched "said"
+    title = title.lower()
+    if any(x in title for x in ["earnings", "profit", "revenue"]):
+        return "Earnings"
+    if any(x in title for x in ["dividend"]):
+        return "Dividend"
+    if any(x in title for x in ["inflation", "fed", "macro", "cpi", "ecb", "rate"]):
+        return "Macro"
+    if any(x in title for x in ["ai", "tech", "chip", "semiconductor", "nvidia", "apple", "google", "microsoft"]):
+        return "Tech"
+    return "General"
+
+
+def synthetic_headlines(count, symbols, seed=0):
+    import random
+    rng = random.Random(seed)
+    words = ("company said shares rose after quarterly earnings beat as chip demand and fed rate cut hopes lift "
+             "markets while investors weigh inflation data dividend payout guidance federal reserve officials "
+             "pirate separately tech stocks rally").split()
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(6, 14))) + f" {rng.choice(symbols)} {rng.choice(symbols)}"
+            for _ in range(count)]
+
+
+def bench_classify(args):
+    from tradebox_stock_tracker import get_category, tag_tickers
+    symbols = [f"T{i}" for i in range(args.symbols)] + ["AAPL", "MSFT", "NVDA", "BRK.B"]
+    if args.feed:
+        import feedparser
+        headlines = [entry.get("title", "") for entry in feedparser.parse(args.feed).entries]
+    else:
+        headlines = synthetic_headlines(args.headlines, symbols)
+    watchlist = frozenset(symbols)
+    cases = {
+        "substring": lambda: [substring_category(h) for h in headlines],
+        "regex": lambda: [get_category(h) for h in headlines],
+        "regex + tickers": lambda: [(get_category(h), tag_tickers(h, watchlist)) for h in headlines],
+    }
+    print(f"{len(headlines)} headlines, {len(watchlist)} watchlist symbols")
+    print(f"{'classifier':<18}{'best ms':>10}{'headlines/s':>14}")
+    for label, func in cases.items():
+        best, _ = measure(lambda _: func(), None, args.repeat)
+        print(f"{label:<18}{best * 1000:>10.2f}{len(headlines) / best:>14,.0f}")
+    changed = sum(old != new for old, new in zip(cases["substring"](), cases["regex"]()))
+    print(f"{changed} headline(s) categorised differently (substring hits such as 'ai' in 'said' are gone)")
+
+
+HEAVY_MODULES = ["yfinance", "aiohttp", "feedparser", "bs4", "matplotlib", "mplfinance", "lxml"]
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_times(module):
+    # Parses `python -X importtime` output into [(depth, module, cumulative us)]
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, cwd=APP_DIR)
+    times = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            times.append((depth, name.strip(), int(cumulative)))
+    return times
+
+
+def _render_page(page):
+    import tradebox_stock_tracker as app
+    app.get_io_loop().wait_all(app.PAGE_LOADERS[page]())
+    app.PAGES[page]()
+
+
+# The app prints refresh errors to stdout too, so the result line is tagged
+FIRST_RENDER_PREFIX = "FIRST_RENDER "
+
+
+def first_render(page):
+    # Runs in a fresh interpreter so nothing is cached or already imported
+    from streamlit.testing.v1 import AppTest
+    started = time.perf_counter()
+    at = AppTest.from_function(_render_page, args=(page,), default_timeout=300)
+    at.run()
+    elapsed = time.perf_counter() - started
+    loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+    print(f"{FIRST_RENDER_PREFIX}{elapsed:.3f} {','.join(loaded) or '-'}", flush=True)
+
+
+def bench_startup(args):
+    times = import_times("tradebox_stock_tracker")
+    app_us = next((us for depth, name, us in times if name == "tradebox_stock_tracker"), 0)
+    print(f"import tradebox_stock_tracker: {app_us / 1000:.0f} ms")
+    print(f"{'direct import':<28}{'cumulative ms':>14}")
+    direct = [(name, us) for depth, name, us in times if depth == 1]
+    for name, us in sorted(direct, key=lambda kv: -kv[1])[:args.top]:
+        print(f"{name:<28}{us / 1000:>14.1f}")
+    imported = {name.split(".")[0] for _, name, _ in times}
+    heavy_at_import = [m for m in HEAVY_MODULES if m in imported]
+    print(f"heavy modules imported at startup: {', '.join(heavy_at_import) or 'none'}")
+    proc = subprocess.run([sys.executable, __file__, "_first_render", args.page],
+                          capture_output=True, text=True, cwd=APP_DIR)
+    result = [line for line in proc.stdout.splitlines() if line.startswith(FIRST_RENDER_PREFIX)]
+    if proc.returncode != 0 or not result:
+        print(proc.stderr[-2000:])
+        sys.exit(f"first render of {args.page} failed")
+    elapsed, loaded = result[-1].removeprefix(FIRST_RENDER_PREFIX).split()
+    print(f"time to first render ({args.page}, cold process): {float(elapsed) * 1000:.0f} ms")
+    print(f"heavy modules loaded by that page: {loaded.replace(',', ', ')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tradebox micro-benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+    parse = sub.add_parser("parse", help="HTML scraper parse time and peak memory, bs4 vs lxml")
+    parse.add_argument("--google", help="saved Google Finance quote page")
+    parse.add_argument("--yahoo", help="saved Yahoo screener page")
+    parse.add_argument("--repeat", type=int, default=5)
+    parse.set_defaults(func=bench_parse)
+    startup = sub.add_parser("startup", help="import-time report and cold time to first render of one page")
+    startup.add_argument("--page", default="News")
+    startup.add_argument("--top", type=int, default=15)
+    startup.set_defaults(func=bench_startup)
+    fmt = sub.add_parser("format", help="movers table formatting + styling, per-cell vs vectorized")
+    fmt.add_argument("--rows", type=int, default=500)
+    fmt.add_argument("--repeat", type=int, default=10)
+    fmt.set_defaults(func=bench_format)
+    classify = sub.add_parser("classify", help="news headline categorisation and ticker tagging throughput")
+    classify.add_argument("--feed", help="saved RSS/Atom feed to take headlines from")
+    classify.add_argument("--headlines", type=int, default=5000)
+    classify.add_argument("--symbols", type=int, default=5000)
+    classify.add_argument("--repeat", type=int, default=5)
+    classify.set_defaults(func=bench_classify)
+    render = sub.add_parser("_first_render")
+    render.add_argument("page")
+    render.set_defaults(func=lambda args: first_render(args.page))
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
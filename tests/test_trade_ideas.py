@@ -0,0 +1,14 @@
+import pandas as pd
+
+import tradebox_stock_tracker as app
+
+
+def test_normalize_trade_ideas_drops_unparseable_dates():
+    ideas = pd.DataFrame([
+        {"Ticker": " aapl ", "Type": "al", "Date": "2025-05-08", "Price": 190, "StopLoss": 180, "TakeProfit": 210},
+        {"Ticker": "MSFT", "Type": "SAT", "Date": "TBD", "Price": 400, "StopLoss": 420, "TakeProfit": 380},
+        {"Ticker": "NVDA", "Type": "AL", "Date": "05/09/2025 14:30", "Price": 120, "StopLoss": 110, "TakeProfit": 140},
+    ])
+    normalized = app.normalize_trade_ideas(ideas)
+    assert list(normalized["Ticker"]) == ["AAPL", "NVDA"]
+    assert list(normalized["Date"]) == [pd.Timestamp("2025-05-08"), pd.Timestamp("2025-05-09")]
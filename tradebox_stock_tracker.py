@@ -1,30 +1,693 @@
 import streamlit as st
-import yfinance as yf
 import pandas as pd
-import datetime
 import pytz
+import os
 import numpy as np
 import requests
-from bs4 import BeautifulSoup
-import feedparser
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
-from concurrent.futures import ThreadPoolExecutor
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, Future
 from datetime import date, timedelta
 import asyncio
-import aiohttp
-import nest_asyncio
-import base64
 import urllib.parse
-import matplotlib.pyplot as plt
-import io
-import matplotlib.dates as mdates
-import mplfinance as mpf
-from functools import lru_cache
+from functools import wraps
+from contextlib import contextmanager, asynccontextmanager
 import json
-from io import StringIO
+import logging
 import calendar
+import hashlib
 import random
 import re
+import lxml.html
+from lxml import etree
+# yfinance, aiohttp and feedparser are imported where they are first used, so a
+# page only pays for the clients it actually touches (`python benchmarks.py startup`)
+
+# Local on-disk state (bar store, name index) lives under one directory
+DATA_DIR = os.environ.get("TRADEBOX_DATA_DIR", ".tradebox_data")
+
+# --- TRACING ---
+# `with span("stage"):` / @traced("stage") time a stage on the monotonic clock and
+# collect the upstream requests, bytes received and cache hits/misses recorded
+# while it is the current span. A trace is one rerun or one background refresh;
+# outside a trace spans cost nothing. Spans follow work onto the I/O loop.
+# TRADEBOX_TRACE_FILE appends every finished trace to that file as one JSON line.
+TRACE_FILE = os.environ.get("TRADEBOX_TRACE_FILE")
+TRACE_COUNTERS = ("requests", "bytes", "hits", "misses", "coalesced")
+_current_span = contextvars.ContextVar("tradebox_span", default=None)
+
+class Trace:
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.time()
+        self.started = time.monotonic()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def records(self):
+        with self.lock:
+            return [s.record() for s in self.spans]
+
+    def to_json(self):
+        return json.dumps({"trace": self.name, "started_at": self.started_at, "spans": self.records()})
+
+class Span:
+    def __init__(self, trace, name, parent):
+        self.trace = trace
+        self.name = name
+        self.parent = parent
+        self.thread = threading.current_thread().name
+        self.counters = dict.fromkeys(TRACE_COUNTERS, 0)
+        self.started = time.monotonic()
+        self.duration = None
+        with trace.lock:
+            self.id = len(trace.spans)
+            trace.spans.append(self)
+
+    def record(self):
+        duration = self.duration if self.duration is not None else time.monotonic() - self.started
+        return {
+            "id": self.id,
+            "parent": self.parent.id if self.parent else None,
+            "name": self.name,
+            "thread": self.thread,
+            "start_ms": round((self.started - self.trace.started) * 1000, 2),
+            "duration_ms": round(duration * 1000, 2),
+            **self.counters,
+        }
+
+@contextmanager
+def span(name):
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    current = Span(parent.trace, name, parent)
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        current.duration = time.monotonic() - current.started
+        _current_span.reset(token)
+
+def traced(name):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def trace_event(counter, amount=1):
+    current = _current_span.get()
+    if current is not None:
+        with current.trace.lock:
+            current.counters[counter] += amount
+
+def carry_span(coro):
+    # Coroutines handed to the I/O loop keep the submitter's span
+    parent = _current_span.get()
+
+    async def run():
+        _current_span.set(parent)
+        return await coro
+    return run()
+
+@st.cache_resource
+def _trace_log():
+    return {"lock": threading.Lock(), "refreshes": {}}
+
+@contextmanager
+def trace_run(name):
+    trace = Trace(name)
+    root = Span(trace, name, None)
+    token = _current_span.set(root)
+    try:
+        yield trace
+    finally:
+        root.duration = time.monotonic() - root.started
+        _current_span.reset(token)
+        if TRACE_FILE:
+            log = _trace_log()
+            with log["lock"], open(TRACE_FILE, "a") as f:
+                f.write(trace.to_json() + "\n")
+
+# --- SHARED SNAPSHOT STORE ---
+# One process-wide store keyed by (kind, key). A fresh entry is a hit; a stale or
+# missing key is fetched by the first session that asks, and every session asking
+# while that fetch runs waits for its result instead of going upstream itself.
+# Values are shared between sessions, so callers treat them as read-only.
+SNAPSHOT_EVENTS = ("hits", "misses", "coalesced")
+
+class SnapshotStore:
+    def __init__(self):
+        self.entries = {}
+        self.stats = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _count(self, kind, event):
+        self.stats.setdefault(kind, dict.fromkeys(SNAPSHOT_EVENTS, 0))[event] += 1
+        trace_event(event)
+
+    def _purge(self, kind, ttl, now):
+        expired = [k for k, (_, stored_at) in self.entries.items() if k[0] == kind and now - stored_at >= ttl]
+        for k in expired:
+            del self.entries[k]
+
+    def get(self, kind, key, ttl, fetch):
+        # ttl=None only coalesces concurrent fetches and keeps nothing
+        with self._lock:
+            entry = self.entries.get((kind, key))
+            if entry is not None and time.time() - entry[1] < ttl:
+                self._count(kind, "hits")
+                return entry[0]
+            flight = self._inflight.get((kind, key))
+            leader = flight is None
+            if leader:
+                flight = self._inflight[(kind, key)] = Future()
+            self._count(kind, "misses" if leader else "coalesced")
+        if not leader:
+            return flight.result()
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[(kind, key)]
+            flight.set_exception(e)
+            raise
+        with self._lock:
+            if ttl is not None:
+                now = time.time()
+                self._purge(kind, ttl, now)
+                self.entries[(kind, key)] = (value, now)
+            del self._inflight[(kind, key)]
+        flight.set_result(value)
+        return value
+
+@st.cache_resource
+def get_snapshot_store():
+    return SnapshotStore()
+
+# --- CACHED DATA LOADERS ---
+# Every upstream fetch is a named loader with its own TTL, backed by the shared
+# snapshot store, so reruns, tab switches and other viewers are free while fresh.
+LOADER_TTLS = {}
+
+@st.cache_resource
+def _loader_status():
+    return {}
+
+def cached_loader(name, ttl):
+    def decorator(func):
+        def fetch(*args, **kwargs):
+            started = time.time()
+            result = func(*args, **kwargs)
+            status = _loader_status().setdefault(name, {"fetches": 0})
+            status["fetches"] += 1
+            status["last_fetch"] = time.time()
+            status["duration"] = status["last_fetch"] - started
+            return result
+
+        @wraps(func)
+        def load(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            with span(f"load:{name}"):
+                return get_snapshot_store().get(name, key, ttl, lambda: fetch(*args, **kwargs))
+        LOADER_TTLS[name] = ttl
+        return load
+    return decorator
+
+@st.cache_resource
+def _process_counters(name):
+    return {}
+
+def process_counters(name, keys):
+    # Counters live in st.cache_resource so every rerun, session and the
+    # background refresher thread update the same dict
+    counters = _process_counters(name)
+    for key in keys:
+        counters.setdefault(key, 0)
+    return counters
+
+# --- RATE LIMITING ---
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens=1):
+        # Returns 0 when the tokens were taken, otherwise how long to wait for them.
+        # At most `capacity` tokens can be taken at once; see installments()
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    def installments(self, tokens):
+        # A cost above the burst is paid in bucket-sized parts, so it is charged in full
+        while tokens > 0:
+            part = min(tokens, self.capacity)
+            yield part
+            tokens -= part
+
+    def acquire(self, tokens=1):
+        for part in self.installments(tokens):
+            while (wait := self.try_acquire(part)) > 0:
+                time.sleep(wait)
+
+# --- SHARED UPSTREAM LIMITER ---
+# One limiter per upstream host: a token bucket for the request budget plus an
+# AIMD concurrency window that halves on 429s/timeouts and creeps back on success.
+YAHOO_API_HOST = "query1.finance.yahoo.com"
+UPSTREAM_BUDGETS = {
+    YAHOO_API_HOST: {"rate": 20.0, "burst": 40, "max_concurrency": 8},
+    "finance.yahoo.com": {"rate": 2.0, "burst": 3, "max_concurrency": 3},
+    "www.google.com": {"rate": 10.0, "burst": 20, "max_concurrency": 10},
+    "news.google.com": {"rate": 2.0, "burst": 4, "max_concurrency": 4},
+}
+DEFAULT_UPSTREAM_BUDGET = {"rate": 5.0, "burst": 10, "max_concurrency": 4}
+
+class UpstreamThrottled(Exception):
+    pass
+
+def is_throttle_error(error):
+    if isinstance(error, (UpstreamThrottled, TimeoutError, requests.exceptions.Timeout)):
+        return True
+    message = str(error)
+    return type(error).__name__ == "YFRateLimitError" or "Too Many Requests" in message or "Rate limit" in message
+
+class UpstreamCall:
+    def __init__(self, width=1):
+        self.throttled = False
+        self.width = width
+
+class HostLimiter:
+    def __init__(self, host, rate, burst, max_concurrency, min_concurrency=1):
+        self.host = host
+        self.bucket = TokenBucket(rate=rate, capacity=burst)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.metrics = {"requests": 0, "ok": 0, "throttled": 0, "errors": 0, "latency_total": 0.0}
+        self._cond = threading.Condition()
+
+    def _try_enter(self):
+        with self._cond:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def _exit(self, started, call, error):
+        with self._cond:
+            self.in_flight -= call.width
+            self.metrics["requests"] += 1
+            self.metrics["latency_total"] += time.monotonic() - started
+            if call.throttled or (error is not None and is_throttle_error(error)):
+                self.metrics["throttled"] += 1
+                self.limit = max(self.min_concurrency, self.limit / 2)
+            elif error is not None:
+                self.metrics["errors"] += 1
+            else:
+                self.metrics["ok"] += 1
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, cost=1, width=1):
+        # `width` concurrent connections are held for the call (a threaded batch
+        # download), trimmed to the current limit; the granted width is call.width
+        with self._cond:
+            while self.in_flight + min(width, max(1, int(self.limit))) > int(self.limit):
+                self._cond.wait()
+            width = min(width, max(1, int(self.limit)))
+            self.in_flight += width
+        self.bucket.acquire(cost)
+        trace_event("requests", cost)
+        call, started = UpstreamCall(width), time.monotonic()
+        try:
+            yield call
+        except Exception as e:
+            self._exit(started, call, e)
+            raise
+        self._exit(started, call, None)
+
+    @asynccontextmanager
+    async def aslot(self, cost=1):
+        while not self._try_enter():
+            await asyncio.sleep(0.05)
+        for part in self.bucket.installments(cost):
+            while (wait := self.bucket.try_acquire(part)) > 0:
+                await asyncio.sleep(wait)
+        trace_event("requests", cost)
+        call, started = UpstreamCall(), time.monotonic()
+        try:
+            yield call
+        except Exception as e:
+            self._exit(started, call, e)
+            raise
+        self._exit(started, call, None)
+
+@st.cache_resource
+def _upstream_limiters():
+    return {}
+
+def get_upstream_limiter(host):
+    limiters = _upstream_limiters()
+    if host not in limiters:
+        budget = UPSTREAM_BUDGETS.get(host, DEFAULT_UPSTREAM_BUDGET)
+        limiters.setdefault(host, HostLimiter(host, **budget))
+    return limiters[host]
+
+def upstream(host, cost=1, width=1):
+    return get_upstream_limiter(host).slot(cost, width)
+
+# Multi-symbol downloads are split into chunks of this many symbols
+YAHOO_CHUNK_SIZE = int(os.environ.get("TRADEBOX_YAHOO_CHUNK_SIZE", 100))
+
+def chunked(items, size):
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+# yf.download swallows per-symbol failures and only logs them (from the calling
+# thread) on the "yfinance" logger, so throttling is read back from those records
+class _YahooErrorLog(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.local = threading.local()
+
+    def emit(self, record):
+        messages = getattr(self.local, "messages", None)
+        if messages is not None:
+            messages.append(record.getMessage())
+
+    @contextmanager
+    def capture(self):
+        self.local.messages = messages = []
+        try:
+            yield messages
+        finally:
+            self.local.messages = None
+
+@st.cache_resource
+def _yahoo_error_log():
+    handler = _YahooErrorLog()
+    logging.getLogger("yfinance").addHandler(handler)
+    return handler
+
+# yfinance calls share one session whose responses are counted into the trace's
+# bytes. Threaded downloads fetch on yfinance's own threads, outside any span, so
+# chart payloads are tallied per symbol there and yf_download claims its symbols'.
+YAHOO_CHART_PATH = re.compile(r"/v8/finance/chart/([^/?]+)")
+
+@st.cache_resource
+def _yahoo_chart_bytes():
+    return {"lock": threading.Lock(), "symbols": {}}
+
+@st.cache_resource
+def _yahoo_session():
+    from yfinance.data import new_session
+    session = new_session()
+    request = session.request
+
+    def counted(*args, **kwargs):
+        response = request(*args, **kwargs)
+        size = len(response.content)
+        url = kwargs.get("url", args[1] if len(args) > 1 else "")
+        chart = YAHOO_CHART_PATH.search(url)
+        if _current_span.get() is None and chart:
+            tally = _yahoo_chart_bytes()
+            symbol = urllib.parse.unquote(chart.group(1)).upper()
+            with tally["lock"]:
+                tally["symbols"][symbol] = tally["symbols"].get(symbol, 0) + size
+        else:
+            trace_event("bytes", size)
+        return response
+    session.request = counted
+    return session
+
+def claim_chart_bytes(symbols):
+    tally = _yahoo_chart_bytes()
+    with tally["lock"]:
+        return sum(tally["symbols"].pop(s.upper(), 0) for s in symbols)
+
+@traced("yahoo.download")
+def yf_download(symbols, threads=True, **kwargs):
+    import yfinance as yf
+    symbols = list(symbols)
+    if threads is True:
+        threads = len(symbols)
+    # yf.download fans out one chart request per symbol, so it is charged per symbol
+    # and runs at most as many threads as the limiter grants connections
+    with upstream(YAHOO_API_HOST, cost=len(symbols), width=max(1, int(threads))) as call, \
+            _yahoo_error_log().capture() as errors:
+        data = yf.download(symbols, threads=call.width if call.width > 1 else False,
+                           session=_yahoo_session(), **kwargs)
+        call.throttled = any(is_throttle_error(Exception(e)) for e in errors)
+    trace_event("bytes", claim_chart_bytes(symbols))
+    return data
+
+# --- ASYNC I/O LOOP ---
+# The app owns one background asyncio loop. Coroutines (aiohttp) run on it
+# directly and blocking calls (yfinance, requests) run in its thread pool, so
+# independent sources overlap instead of running one after another.
+# Blocking calls run on a ladder of pools: work submitted from a pool-N thread
+# (a prefetch that fans out into chunks, a refresher job that parses feeds) goes
+# to pool N+1, so a worker waiting on the work it spawned never holds a thread
+# that work needs and nested fan-out can't starve itself.
+IO_MAX_WORKERS = int(os.environ.get("TRADEBOX_IO_MAX_WORKERS", 32))
+_pool_level = contextvars.ContextVar("tradebox_pool_level", default=-1)
+
+class AsyncIOLoop:
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.loop = asyncio.new_event_loop()
+        self._pools = []
+        self._pools_lock = threading.Lock()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="tradebox-io-loop", daemon=True)
+        self._thread.start()
+
+    def _pool(self, level):
+        with self._pools_lock:
+            while len(self._pools) <= level:
+                self._pools.append(ThreadPoolExecutor(max_workers=self.max_workers,
+                                                      thread_name_prefix=f"tradebox-io{len(self._pools)}"))
+            return self._pools[level]
+
+    def submit(self, coro):
+        level = _pool_level.get()
+
+        async def run():
+            # Blocking calls the coroutine hands back land one pool below its submitter
+            _pool_level.set(level)
+            return await coro
+        return asyncio.run_coroutine_threadsafe(carry_span(run()), self.loop)
+
+    def submit_blocking(self, func, *args):
+        level = _pool_level.get() + 1
+
+        def run():
+            _pool_level.set(level)
+            return func(*args)
+        # The copied context also carries the current trace span onto the worker
+        return self._pool(level).submit(contextvars.copy_context().run, run)
+
+    def run(self, coro):
+        return self.submit(coro).result()
+
+    def map_blocking(self, func, items):
+        futures = [self.submit_blocking(func, item) for item in items]
+        return [f.result() for f in futures]
+
+    def wait_all(self, calls):
+        # calls: [(func, *args)]; runs them all at once, errors are left for the caller's own call to surface
+        futures = [self.submit_blocking(func, *args) for func, *args in calls]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Prefetch failed: {e}")
+
+@st.cache_resource
+def get_io_loop():
+    return AsyncIOLoop(IO_MAX_WORKERS)
+
+# --- POOLED HTTP CLIENTS ---
+# One keep-alive requests.Session and one long-lived aiohttp session (on the app's
+# I/O loop) per server, shared by the scraper, movers and news fetchers.
+HTTP_POOL_SIZE = int(os.environ.get("TRADEBOX_HTTP_POOL_SIZE", 20))
+HTTP_TIMEOUT = float(os.environ.get("TRADEBOX_HTTP_TIMEOUT", 10))
+HTTP_RETRIES = int(os.environ.get("TRADEBOX_HTTP_RETRIES", 2))
+HTTP_HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+@st.cache_resource
+def get_http_session():
+    session = requests.Session()
+    # 429s are left to the upstream limiter; only transient server errors are retried here
+    retries = Retry(total=HTTP_RETRIES, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504),
+                    allowed_methods=frozenset(["GET", "HEAD"]))
+    adapter = HTTPAdapter(pool_connections=len(UPSTREAM_BUDGETS) + 2, pool_maxsize=HTTP_POOL_SIZE, max_retries=retries)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(HTTP_HEADERS)
+    return session
+
+def http_get(url, **kwargs):
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    r = get_http_session().get(url, **kwargs)
+    trace_event("bytes", len(r.content))
+    return r
+
+class AsyncHttpClient:
+    def __init__(self, io_loop):
+        self.stats = {"connections_created": 0, "connections_reused": 0}
+        self.io_loop = io_loop
+        self.session = self.run(self._create_session())
+
+    async def _create_session(self):
+        import aiohttp
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(self._on_connection_created)
+        trace.on_connection_reuseconn.append(self._on_connection_reused)
+        connector = aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, keepalive_timeout=60)
+        return aiohttp.ClientSession(connector=connector, headers=HTTP_HEADERS, trace_configs=[trace],
+                                     timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT))
+
+    async def _on_connection_created(self, session, ctx, params):
+        self.stats["connections_created"] += 1
+
+    async def _on_connection_reused(self, session, ctx, params):
+        self.stats["connections_reused"] += 1
+
+    def run(self, coro):
+        return self.io_loop.run(coro)
+
+@st.cache_resource
+def _open_http_clients():
+    return {}
+
+@st.cache_resource
+def get_async_http_client():
+    client = AsyncHttpClient(get_io_loop())
+    # Registered so the stats panel can report on it without opening one (and importing aiohttp)
+    _open_http_clients()["aiohttp"] = client
+    return client
+
+def get_connection_stats():
+    pools = []
+    # The same adapter is mounted for http:// and https://
+    for adapter in {id(a): a for a in get_http_session().adapters.values()}.values():
+        pool_manager = adapter.poolmanager
+        pools.extend(pool_manager.pools[key] for key in pool_manager.pools.keys())
+    requests_sent = sum(pool.num_requests for pool in pools)
+    requests_new = sum(pool.num_connections for pool in pools)
+    stats = {"requests.Session": {"requests": requests_sent, "new connections": requests_new,
+                                  "reused": max(requests_sent - requests_new, 0)}}
+    client = _open_http_clients().get("aiohttp")
+    if client is not None:
+        aio = client.stats
+        stats["aiohttp"] = {"requests": aio["connections_created"] + aio["connections_reused"],
+                            "new connections": aio["connections_created"], "reused": aio["connections_reused"]}
+    return stats
+
+def render_upstream_panel():
+    rows = []
+    for host, limiter in _upstream_limiters().items():
+        m = limiter.metrics
+        rows.append({
+            "Host": host,
+            "Requests": m["requests"],
+            "OK": m["ok"],
+            "Throttled": m["throttled"],
+            "Errors": m["errors"],
+            "In flight": limiter.in_flight,
+            "Concurrency": round(limiter.limit, 2),
+            "Avg latency (s)": round(m["latency_total"] / m["requests"], 2) if m["requests"] else None,
+        })
+    with st.sidebar.expander("Upstream hosts"):
+        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        connection_stats = pd.DataFrame(get_connection_stats()).T
+        connection_stats["Reuse %"] = (connection_stats["reused"] / connection_stats["requests"].where(connection_stats["requests"] > 0) * 100).round(1)
+        st.dataframe(connection_stats, use_container_width=True)
+
+def render_cache_status_panel():
+    status = _loader_status()
+    store_stats = get_snapshot_store().stats
+    now = time.time()
+    rows = []
+    for name, ttl in LOADER_TTLS.items():
+        entry = status.get(name, {})
+        counts = store_stats.get(name, dict.fromkeys(SNAPSHOT_EVENTS, 0))
+        age = now - entry["last_fetch"] if "last_fetch" in entry else None
+        rows.append({
+            "Loader": name,
+            "TTL (s)": ttl,
+            "Fetches": entry.get("fetches", 0),
+            "Hits": counts["hits"],
+            "Misses": counts["misses"],
+            "Coalesced": counts["coalesced"],
+            "Age (s)": round(age) if age is not None else None,
+            "Last fetch (s)": round(entry["duration"], 2) if "duration" in entry else None,
+            "Status": "empty" if age is None else "fresh" if age < ttl else "stale",
+        })
+    with st.sidebar.expander("Cache status"):
+        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+
+def trace_frame(trace):
+    records = trace.records()
+    # Indent by depth so the waterfall reads like a call tree; a parent always has a lower id
+    depth = {}
+    for r in records:
+        depth[r["id"]] = 0 if r["parent"] is None else depth[r["parent"]] + 1
+        r["stage"] = f"{r['id']:>3} " + "\u2003" * depth[r["id"]] + r["name"]
+    spans = pd.DataFrame(records)
+    spans["end_ms"] = spans["start_ms"] + spans["duration_ms"]
+    return spans
+
+def render_performance_panel(trace):
+    if not st.sidebar.toggle("Performance", key="perf_panel", help="Stage timings of the latest rerun"):
+        return
+    with st.sidebar.expander("Performance", expanded=True):
+        spans = trace_frame(trace)
+        root = spans.iloc[0]
+        st.caption(
+            f"{trace.name}: {root['duration_ms']:.0f} ms · {spans['requests'].sum()} upstream request(s), "
+            f"{spans['bytes'].sum() / 1024:.0f} KB · cache {spans['hits'].sum()} hit(s), "
+            f"{spans['misses'].sum()} miss(es), {spans['coalesced'].sum()} coalesced"
+        )
+        import altair as alt
+        waterfall = alt.Chart(spans).mark_bar().encode(
+            x=alt.X("start_ms", title="ms"), x2="end_ms",
+            y=alt.Y("stage", sort=None, title=None),
+            color=alt.Color("thread", legend=None),
+            tooltip=["name", "thread", "duration_ms", *TRACE_COUNTERS],
+        )
+        st.altair_chart(waterfall, use_container_width=True)
+        slowest = spans.iloc[1:].nlargest(5, "duration_ms")
+        st.dataframe(slowest[["name", "duration_ms", *TRACE_COUNTERS]], use_container_width=True, hide_index=True)
+        refreshes = _trace_log()["refreshes"]
+        if refreshes:
+            st.caption("Latest background refresh per job")
+            st.dataframe(pd.DataFrame([
+                {"Job": kind, "ms": round(t.records()[0]["duration_ms"]),
+                 **{c: sum(r[c] for r in t.records()) for c in TRACE_COUNTERS}}
+                for kind, t in refreshes.items()
+            ]), use_container_width=True, hide_index=True)
+        export = "\n".join([trace.to_json()] + [t.to_json() for t in refreshes.values()]) + "\n"
+        st.download_button("Export traces (JSONL)", export, file_name="tradebox_traces.jsonl", mime="application/jsonl")
 
 # --- NEWS KARTLARI İÇİN FAVICON, PREVIEW IMAGE ve KATEGORİ ---
 def get_favicon(domain):
@@ -44,10 +707,7 @@ def get_news_image(entry):
                 url = l.get('href', '')
                 if url: return url
     # Başlıktan anahtar kelime seç, Unsplash görseli oluştur
-    stopwords = set(['the','a','an','and','or','for','to','of','in','on','at','by','with','is','are','was','were','be','as','from','that','this','it','its','but','not','will','may','can','should','after','up','over','why','how','if','so','than','then','out','off','into','about','more','less','new','old','all','any','some','no','yes','just','you','i','we','he','she','they','their','his','her','our','your','my','me','us','them','who','what','which','when','where'])
-    title = getattr(entry, 'title', '')
-    words = re.findall(r"\b\w+\b", title.lower())
-    keywords = [w for w in words if w not in stopwords and len(w) > 2][:2]
+    keywords = image_keywords(getattr(entry, 'title', ''))
     if keywords:
         unsplash_url = f"https://source.unsplash.com/600x400/?{','.join(keywords)}"
         return unsplash_url
@@ -64,43 +724,425 @@ def get_news_image(entry):
     }
     return default_images.get(cat, default_images["General"])
 
+# --- NEWS TAGGING ---
+# Headlines are classified with one precompiled regex per lexicon category, tried
+# in lexicon order on the lower-cased title: whole words only (so "ai" no longer
+# matches "said") with an optional plural "s"; the first category that matches wins.
+# TRADEBOX_NEWS_LEXICON can point to a JSON file {"Category": ["word", "two words"], ...}.
+NEWS_CATEGORY_LEXICON = {
+    "Earnings": ["earnings", "profit", "revenue"],
+    "Dividend": ["dividend"],
+    "Macro": ["inflation", "fed", "macro", "cpi", "ecb", "rate"],
+    "Tech": ["ai", "tech", "chip", "semiconductor", "nvidia", "apple", "google", "microsoft"],
+}
+NEWS_LEXICON_PATH = os.environ.get("TRADEBOX_NEWS_LEXICON")
+DEFAULT_NEWS_CATEGORY = "General"
+STOPWORDS = frozenset([
+    'the', 'a', 'an', 'and', 'or', 'for', 'to', 'of', 'in', 'on', 'at', 'by', 'with', 'is', 'are', 'was', 'were',
+    'be', 'as', 'from', 'that', 'this', 'it', 'its', 'but', 'not', 'will', 'may', 'can', 'should', 'after', 'up',
+    'over', 'why', 'how', 'if', 'so', 'than', 'then', 'out', 'off', 'into', 'about', 'more', 'less', 'new', 'old',
+    'all', 'any', 'some', 'no', 'yes', 'just', 'you', 'i', 'we', 'he', 'she', 'they', 'their', 'his', 'her', 'our',
+    'your', 'my', 'me', 'us', 'them', 'who', 'what', 'which', 'when', 'where',
+])
+KEYWORD_PATTERN = re.compile(r"\b\w{3,}\b")
+# Upper-case tokens that could be symbols; one-letter symbols only count as $X cashtags
+TICKER_CANDIDATE_PATTERN = re.compile(r"(?<![\w$])(\$?)([A-Z][A-Z0-9]*(?:[.-][A-Z])?)(?!\w)")
+
+def load_news_lexicon(path):
+    if not path:
+        return NEWS_CATEGORY_LEXICON
+    with open(path) as f:
+        return json.load(f)
+
+def compile_lexicon(lexicon):
+    compiled = []
+    for category, words in lexicon.items():
+        patterns = sorted((r"\s+".join(map(re.escape, word.lower().split())) for word in words), key=len, reverse=True)
+        compiled.append((category, re.compile(rf"\b(?:{'|'.join(patterns)})s?\b")))
+    return compiled
+
+CATEGORY_PATTERNS = compile_lexicon(load_news_lexicon(NEWS_LEXICON_PATH))
+
 def get_category(title):
     title = title.lower()
-    if any(x in title for x in ["earnings", "profit", "revenue"]):
-        return "Earnings"
-    if any(x in title for x in ["dividend"]):
-        return "Dividend"
-    if any(x in title for x in ["inflation", "fed", "macro", "cpi", "ecb", "rate"]):
-        return "Macro"
-    if any(x in title for x in ["ai", "tech", "chip", "semiconductor", "nvidia", "apple", "google", "microsoft"]):
-        return "Tech"
-    return "General"
+    for category, pattern in CATEGORY_PATTERNS:
+        if pattern.search(title):
+            return category
+    return DEFAULT_NEWS_CATEGORY
+
+def image_keywords(title, count=2):
+    keywords = []
+    for word in KEYWORD_PATTERN.findall(title.lower()):
+        if word not in STOPWORDS:
+            keywords.append(word)
+            if len(keywords) == count:
+                break
+    return keywords
+
+def tag_tickers(text, symbols):
+    # symbols is a set, so the cost follows the headline, not the watchlist size
+    tags = (symbol for cashtag, symbol in TICKER_CANDIDATE_PATTERN.findall(text)
+            if symbol in symbols and (cashtag or len(symbol) > 1))
+    return list(dict.fromkeys(tags))
+
+# --- HTML SCRAPERS ---
+# All page selectors live here, compiled once. When Google or Yahoo change their
+# markup this is the only place to fix; lxml parses the page without building
+# a BeautifulSoup tree (see `python benchmarks.py parse`).
+SCRAPE_SELECTORS = {
+    "google_price": etree.XPath('string((//div[@class="YMlKec fxKbKc"])[1])'),
+    "google_name": etree.XPath('string((//div[@class="zzDege"])[1])'),
+    "yahoo_table": etree.XPath('(//table)[1]'),
+    "yahoo_header": etree.XPath('.//thead//th'),
+    "yahoo_rows": etree.XPath('.//tbody/tr'),
+    "yahoo_cells": etree.XPath('./td'),
+}
+
+def _parse_html(text):
+    return lxml.html.fromstring(text) if text.strip() else None
+
+def parse_google_quote(text):
+    # Returns (close price or None, company name)
+    doc = _parse_html(text)
+    if doc is None:
+        return None, ''
+    price = SCRAPE_SELECTORS["google_price"](doc).strip()
+    name = SCRAPE_SELECTORS["google_name"](doc).strip()
+    return (float(price.replace(",", "").replace("$", "")) if price else None), name
+
+def _cell_text(cell):
+    return " ".join(cell.text_content().split())
+
+def _numeric_column(values):
+    # Same inference as pd.read_html: "1,234" -> 1234, anything non-numeric stays text
+    try:
+        return pd.to_numeric(values.str.replace(",", "", regex=False))
+    except (ValueError, TypeError):
+        return values
+
+def parse_yahoo_table(text, max_rows=None):
+    doc = _parse_html(text)
+    tables = SCRAPE_SELECTORS["yahoo_table"](doc) if doc is not None else []
+    if not tables:
+        return pd.DataFrame()
+    header = [_cell_text(th) or f"Unnamed: {i}" for i, th in enumerate(SCRAPE_SELECTORS["yahoo_header"](tables[0]))]
+    rows = SCRAPE_SELECTORS["yahoo_rows"](tables[0])[:max_rows]
+    records = [[_cell_text(td) for td in SCRAPE_SELECTORS["yahoo_cells"](tr)] for tr in rows]
+    df = pd.DataFrame([r[:len(header)] + [None] * (len(header) - len(r)) for r in records], columns=header, dtype=object)
+    return df.apply(_numeric_column)
+
+# --- TABLE FORMATTING ---
+# Tables keep raw numbers; display strings and +/- colours are built a whole
+# column at a time from them (no per-cell parse/format callables).
+PNL_COLORS = ('color: #188038; font-weight: bold;', 'color: #d93025; font-weight: bold;')
+COMPACT_UNITS = [(1e12, 'T'), (1e9, 'B'), (1e6, 'M'), (1e3, 'K')]
+
+def to_number(values):
+    # "1,234.5", "+0.45%", "$12" -> float; anything else -> NaN
+    values = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float)
+    cleaned = values.astype(str).str.replace(r'[,%$+]', '', regex=True).str.strip()
+    return pd.to_numeric(cleaned, errors='coerce')
+
+def _with_fallback(values, numbers, text, na):
+    # na=None keeps the original cell wherever it didn't parse as a number
+    values = pd.Series(values)
+    ok = ~np.isnan(numbers)
+    if na is None and not ok.all():
+        na = values.astype(object).where(values.notna(), "").to_numpy()
+    return pd.Series(np.where(ok, np.array(text, dtype=object), na if na is not None else ""), index=values.index, dtype=object)
+
+def format_fixed(values, decimals=2, sign=False, suffix="", thousands=True, na=""):
+    numbers = to_number(values).to_numpy(dtype=float)
+    spec = f"{{:{'+' if sign else ''}{',' if thousands else ''}.{decimals}f}}{suffix}".format
+    return _with_fallback(values, numbers, [spec(x) for x in numbers.tolist()], na)
+
+def format_compact(values, decimals=2, units=('B', 'M', 'K'), na=""):
+    # 1_234_000 -> "1.23M"; numbers below the smallest unit are shown as integers
+    numbers = to_number(values).to_numpy(dtype=float)
+    magnitude = np.abs(numbers)
+    scales = [(scale, unit) for scale, unit in COMPACT_UNITS if unit in units]
+    conditions = [magnitude >= scale for scale, _ in scales]
+    scale = np.select(conditions, [scale for scale, _ in scales], 1.0)
+    suffix = np.select(conditions, [unit for _, unit in scales], '')
+    scaled_spec, plain_spec = f"%.{decimals}f%s", "%.0f%s"
+    text = [(scaled_spec if unit else plain_spec) % (x, unit) for x, unit in zip((numbers / scale).tolist(), suffix.tolist())]
+    return _with_fallback(values, numbers, text, na)
+
+def pnl_colors(values):
+    numbers = to_number(values).to_numpy(dtype=float)
+    return np.select([numbers > 0, numbers < 0], PNL_COLORS, '')
+
+def style_pnl(display, columns, numbers=None):
+    # Colours come from the numeric source when it is given, else the display strings are parsed once per column
+    numbers = display if numbers is None else numbers
+    columns = [c for c in columns if c in display.columns]
+    return display.style.apply(lambda col: pnl_colors(numbers[col.name].to_numpy()), subset=columns)
 
 # --- Market Movers veri çekme fonksiyonu ---
-@lru_cache(maxsize=3)
+MOVER_TYPES = ['gainers', 'losers', 'actives']
+
+MOVER_URLS = {
+    'gainers': 'https://finance.yahoo.com/screener/predefined/day_gainers',
+    'losers': 'https://finance.yahoo.com/screener/predefined/day_losers',
+    'actives': 'https://finance.yahoo.com/screener/predefined/most_actives',
+}
+# Within MOVERS_TTL a list is served from memory. After that it is re-checked
+# with a conditional GET (ETag / Last-Modified), and a full response whose body
+# hashes the same as last time is not parsed (or re-formatted) again.
+MOVERS_TTL = 60
+movers_stats = process_counters("movers", ("requests", "not_modified", "unchanged", "parsed"))
+
+@st.cache_resource
+def _movers_cache():
+    return {}
+
+@traced("movers.scrape")
 def get_yahoo_movers(mover_type):
-    url_map = {
-        'gainers': 'https://finance.yahoo.com/screener/predefined/day_gainers',
-        'losers': 'https://finance.yahoo.com/screener/predefined/day_losers',
-        'actives': 'https://finance.yahoo.com/screener/predefined/most_actives',
+    cache = _movers_cache()
+    entry = cache.get(mover_type)
+    now = time.time()
+    if entry and now - entry["checked_at"] < MOVERS_TTL:
+        return dict(entry)
+    url = MOVER_URLS[mover_type]
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    with upstream("finance.yahoo.com"):
+        movers_stats["requests"] += 1
+        r = http_get(url, headers=headers)
+        if r.status_code == 429:
+            raise UpstreamThrottled(url)
+    if entry and r.status_code == 304:
+        movers_stats["not_modified"] += 1
+        entry = dict(entry, checked_at=now)
+    else:
+        r.raise_for_status()
+        digest = hashlib.sha1(r.content).hexdigest()
+        if entry and entry["hash"] == digest:
+            movers_stats["unchanged"] += 1
+            entry = dict(entry, checked_at=now)
+        else:
+            movers_stats["parsed"] += 1
+            entry = {"df": parse_yahoo_table(r.text, max_rows=15), "hash": digest, "changed_at": now, "checked_at": now}
+        entry["etag"] = r.headers.get("ETag")
+        entry["last_modified"] = r.headers.get("Last-Modified")
+    cache[mover_type] = entry
+    return dict(entry)
+
+def _movers_or_last_known(mover_type):
+    try:
+        return get_yahoo_movers(mover_type)
+    except Exception:
+        # One failing list doesn't discard the other two; it keeps its last good table
+        if mover_type not in _movers_cache():
+            raise
+        return dict(_movers_cache()[mover_type])
+
+def load_all_movers():
+    # The three lists are fetched side by side on the I/O loop
+    return dict(zip(MOVER_TYPES, get_io_loop().map_blocking(_movers_or_last_known, MOVER_TYPES)))
+
+def movers_age_caption(entry):
+    now = time.time()
+    return (f"Checked {now - entry['checked_at']:.0f}s ago · data last changed {now - entry['changed_at']:.0f}s ago · "
+            f"{movers_stats['not_modified'] + movers_stats['unchanged']} of {movers_stats['requests']} request(s) found no change")
+
+@st.cache_resource
+def _formatted_movers():
+    return {}
+
+def formatted_movers(mover_type, entry):
+    # Formatting is redone only when the page content (its hash) changed
+    formatted = _formatted_movers()
+    cached = formatted.get(mover_type)
+    if cached is None or cached[0] != entry["hash"]:
+        cached = formatted[mover_type] = (entry["hash"], format_movers_table(entry["df"]))
+    return cached[1].copy()
+
+@traced("table.format")
+def format_movers_table(df):
+    df = df.reset_index(drop=True).drop(columns=['Unnamed: 0'], errors='ignore')  # Index sütununu kaldır
+    # Sade ve okunaklı sayı formatı uygula
+    formatted = {}
+    for col in df.columns:
+        name = col.lower()
+        if 'volume' in name:
+            formatted[col] = format_compact(df[col], na=None)
+        elif 'market cap' in name:
+            formatted[col] = format_compact(df[col], units=('B', 'M'), na=None)
+        elif any(x in name for x in ['price', 'change', 'close', 'open', 'low', 'high']) and pd.api.types.is_numeric_dtype(df[col]):
+            formatted[col] = format_fixed(df[col], na=None)
+    return df.assign(**formatted)
+
+
+# --- NEWS AGGREGATOR ---
+# The background refresher polls every feed with conditional GETs side by side on
+# the async client and parses the changed ones in its own thread. Each story is
+# enriched once at ingest (domain, favicon, category) into a bounded index that
+# is deduplicated by normalized link and title; the News tab only reads it.
+GOOGLE_NEWS_SEARCH = "https://news.google.com/rss/search?q={query}&hl=en-US&gl=US&ceid=US:en"
+YAHOO_HEADLINES = "https://feeds.finance.yahoo.com/rss/2.0/headline?s={symbols}&region=US&lang=en-US"
+NEWS_FEEDS = {
+    "Market": GOOGLE_NEWS_SEARCH.format(query="stock+market"),
+    "Yahoo Finance": "https://finance.yahoo.com/news/rssindex",
+}
+# Extra feed URLs, whitespace separated
+NEWS_EXTRA_FEEDS = os.environ.get("TRADEBOX_NEWS_FEEDS", "").split()
+# The first watchlist symbols get their own Google News query; Yahoo headline feeds take 20 symbols per request
+NEWS_TICKER_FEEDS = int(os.environ.get("TRADEBOX_NEWS_TICKER_FEEDS", 10))
+NEWS_YAHOO_TICKERS = 100
+NEWS_YAHOO_CHUNK = 20
+NEWS_INDEX_SIZE = 500
+NEWS_PAGE_SIZE = 30
+news_stats = process_counters("news", ("requests", "not_modified", "unchanged", "parsed", "ingested", "duplicates"))
+
+def news_feed_urls(symbols):
+    feeds = dict(NEWS_FEEDS)
+    for symbol in symbols[:NEWS_TICKER_FEEDS]:
+        feeds[symbol] = GOOGLE_NEWS_SEARCH.format(query=urllib.parse.quote_plus(f"{symbol} stock"))
+    for i, chunk in enumerate(chunked(symbols[:NEWS_YAHOO_TICKERS], NEWS_YAHOO_CHUNK)):
+        feeds[f"Yahoo headlines {i + 1}"] = YAHOO_HEADLINES.format(symbols=",".join(chunk))
+    for url in NEWS_EXTRA_FEEDS:
+        feeds[url] = url
+    return feeds
+
+def _digest(text):
+    return hashlib.sha1(text.encode()).hexdigest()
+
+# Query parameters that only track the click; the rest (article ids etc.) identify the story
+NEWS_TRACKING_PARAMS = frozenset({"oc", ".tsrc", "guccounter", "guce_referrer", "guce_referrer_sig", "fbclid",
+                                  "gclid", "mc_cid", "mc_eid", "ref", "cmpid", "ncid", "soc_src", "soc_trk"})
+
+def news_link_key(link):
+    # Tracking parameters, parameter order and www. don't make a different story
+    parts = urllib.parse.urlsplit(link.strip())
+    query = sorted((k, v) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+                   if not k.lower().startswith("utm_") and k.lower() not in NEWS_TRACKING_PARAMS)
+    key = parts.netloc.lower().removeprefix("www.") + parts.path.rstrip("/")
+    return _digest(key + ("?" + urllib.parse.urlencode(query) if query else ""))
+
+def news_title_key(title):
+    return _digest(" ".join(re.findall(r"\w+", title.lower())))
+
+def news_item(entry, feed, symbols):
+    title = entry.get('title', '')
+    link = entry.get('link', '')
+    source = entry.get('source') or {}
+    if source.get('title') and title.endswith(f" - {source['title']}"):
+        # Google News appends the publisher to the headline
+        title = title[:-len(source['title']) - 3]
+    domain = urllib.parse.urlparse(source.get('href') or link).netloc.replace('www.', '')
+    summary = " ".join(re.sub(r"<[^>]+>", " ", entry.get('summary', '')).split())
+    published = entry.get('published_parsed')
+    return {
+        "link_key": news_link_key(link),
+        "title_key": news_title_key(title),
+        "title": title,
+        "link": link,
+        "summary": summary[:110] + '...' if len(summary) > 110 else summary,
+        "domain": domain,
+        "favicon": get_favicon(domain),
+        "category": get_category(title),
+        "tickers": tag_tickers(f"{title} {summary}", symbols),
+        "published": calendar.timegm(published) if published else time.time(),
+        "feed": feed,
     }
-    url = url_map[mover_type]
-    headers = {"User-Agent": "Mozilla/5.0"}
-    r = requests.get(url, headers=headers, timeout=10)
-    soup = BeautifulSoup(r.text, "html.parser")
-    table = soup.find('table')
-    if not table:
-        return pd.DataFrame()
-    df = pd.read_html(StringIO(str(table)))[0]
-    df = df.head(15)
-    return df
 
-# --- Economic Calendar ve Selenium fonksiyonları tamamen kaldırıldı ---
+def parse_feed(feed_body):
+    import feedparser
+    feed, body, symbols = feed_body
+    return [news_item(entry, feed, symbols) for entry in feedparser.parse(body).entries]
 
-st.set_page_config(page_title="Tradebox Stock Tracker", layout="wide")
+async def fetch_feed(session, url, validators):
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    async with get_upstream_limiter(urllib.parse.urlparse(url).netloc).aslot():
+        news_stats["requests"] += 1
+        async with session.get(url, headers=headers) as r:
+            if r.status == 429:
+                raise UpstreamThrottled(url)
+            if r.status == 304:
+                return None, validators
+            r.raise_for_status()
+            body = await r.read()
+            trace_event("bytes", len(body))
+            return body, {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+
+async def fetch_all_feeds(session, urls, validators):
+    tasks = [fetch_feed(session, url, validators.get(url, {})) for url in urls]
+    return await asyncio.gather(*tasks, return_exceptions=True)
+
+class NewsIndex:
+    def __init__(self, size):
+        self.size = size
+        self.stories = {}
+        self.titles = set()
+        self.feeds = {}
+        self.latest = []
+        self._lock = threading.Lock()
+
+    def refresh(self, feeds, symbols=frozenset()):
+        client = get_async_http_client()
+        results = client.run(fetch_all_feeds(client.session, list(feeds.values()), self.feeds))
+        changed = []
+        for (name, url), result in zip(feeds.items(), results):
+            if isinstance(result, Exception):
+                print(f"News feed error for {name}: {result}")
+                continue
+            body, validators = result
+            if body is None:
+                news_stats["not_modified"] += 1
+                continue
+            digest = hashlib.sha1(body).hexdigest()
+            if self.feeds.get(url, {}).get("hash") == digest:
+                news_stats["unchanged"] += 1
+                continue
+            self.feeds[url] = dict(validators, hash=digest)
+            news_stats["parsed"] += 1
+            changed.append((name, body, symbols))
+        for items in get_io_loop().map_blocking(parse_feed, changed):
+            self.ingest(items)
+        return self.latest
+
+    def ingest(self, items):
+        with self._lock:
+            for item in items:
+                if item["link_key"] in self.stories or item["title_key"] in self.titles:
+                    news_stats["duplicates"] += 1
+                    continue
+                self.stories[item["link_key"]] = item
+                self.titles.add(item["title_key"])
+                news_stats["ingested"] += 1
+            latest = sorted(self.stories.values(), key=lambda item: item["published"], reverse=True)
+            for item in latest[self.size:]:
+                del self.stories[item["link_key"]]
+                self.titles.discard(item["title_key"])
+            # Readers get a new list, never one that is being modified
+            self.latest = latest[:self.size]
+
+@st.cache_resource
+def get_news_index():
+    return NewsIndex(NEWS_INDEX_SIZE)
+
+# The News page reads this loader itself rather than a refresher snapshot, so
+# opening it cold doesn't start every refresh job (and yfinance with them); the
+# refresher's news job goes through the same loader and keeps it warm
+@cached_loader("news", ttl=300)
+def load_news(symbols):
+    return get_news_index().refresh(news_feed_urls(symbols), frozenset(symbols))
+
+# --- Economic Calendar ve Selenium fonksiyonları tamamen kaldırıldı ---
 
 # --- MOBİL (iOS) DOSTU CSS ---
-st.markdown('''
+def render_header():
+    st.markdown('''
 <meta name="viewport" content="width=device-width, initial-scale=1, maximum-scale=1, user-scalable=no">
 <style>
 /* Navbar mobil */
@@ -127,8 +1169,8 @@ st.markdown('''
 </style>
 ''', unsafe_allow_html=True)
 
-# --- LOGO & HEADER ---
-st.markdown('''
+    # --- LOGO & HEADER ---
+    st.markdown('''
 <style>
 .sw-header-row {
   display: flex;
@@ -227,19 +1269,14 @@ spinner_css = '''<style>
 </style>'''
 
 # --- VIX GÖSTERGESİ ---
-def get_vix_value():
-    try:
-        vix = yf.Ticker('^VIX')
-        hist = vix.history(period="1d", interval="1m")
-        if not hist.empty:
-            return float(hist['Close'].iloc[-1])
-    except Exception:
-        pass
-    return None
-vix_val = get_vix_value()
-vix_color = '#6ee26e' if vix_val and vix_val < 15 else '#fbbc04' if vix_val and vix_val < 25 else '#d93025'
-vix_label = 'Calm' if vix_val and vix_val < 15 else 'Neutral' if vix_val and vix_val < 25 else 'Fear'
-vix_html = f'''
+def get_vix_html():
+    # VIX comes with the index snapshot, see load_index_snapshot
+    index_snapshot, _ = read_snapshot("index_snapshot")
+    vix_val = index_snapshot.at['VIX', 'Price'] if index_snapshot is not None else None
+    vix_val = None if pd.isna(vix_val) else float(vix_val)
+    vix_color = '#6ee26e' if vix_val and vix_val < 15 else '#fbbc04' if vix_val and vix_val < 25 else '#d93025'
+    vix_label = 'Calm' if vix_val and vix_val < 15 else 'Neutral' if vix_val and vix_val < 25 else 'Fear'
+    vix_html = f'''
 <style>
 .vix-box {{
   display: inline-flex;
@@ -265,6 +1302,7 @@ vix_html = f'''
   <span class="vix-dot"></span>VIX: <span style="color:{vix_color}; margin-left:4px;">{vix_val:.2f}</span> <span style="color:#fff; font-size:0.97em; margin-left:7px;">{vix_label}</span>
 </div>
 ''' if vix_val else ''
+    return vix_html
 
 # --- SEKTÖR HEATMAP (KOYU PASTEL, EN ALTA, BİTİŞİK) ---
 sector_heatmap_data = [
@@ -276,24 +1314,22 @@ sector_heatmap_data = [
     {"sector": "Utilities", "change": -0.2},
 ]
 sector_colors = lambda chg: '#234e3c' if chg > 1 else '#3a3a2e' if chg > 0 else '#4a2323' if chg < 0 else '#33343a'
-heatmap_html = '<div class="sector-heatmap-mobile" style="display:flex;gap:0;margin:0 0 0 0;flex-wrap:wrap;">'
-for i, s in enumerate(sector_heatmap_data):
-    color = sector_colors(s['change'])
-    sign = '+' if s['change'] > 0 else ''
-    left_radius = '10px' if i == 0 else '0'
-    right_radius = '10px' if i == len(sector_heatmap_data)-1 else '0'
-    heatmap_html += f'<div style="background:{color};color:#e0e0e0;font-weight:700;border-top-left-radius:{left_radius};border-bottom-left-radius:{left_radius};border-top-right-radius:{right_radius};border-bottom-right-radius:{right_radius};padding:10px 18px;min-width:90px;text-align:center;box-shadow:0 2px 8px #0001;font-size:1.08em;border-right:1.5px solid #232;">'
-    heatmap_html += f'<span style="color:#e0e0e0;font-weight:700;">{s["sector"]}</span><br>'
-    heatmap_html += f'<span style="font-size:0.97em;font-weight:700;color:#e0e0e0;">{sign}{s["change"]:.2f}%</span>'
+def get_sector_heatmap_html():
+    heatmap_html = '<div class="sector-heatmap-mobile" style="display:flex;gap:0;margin:0 0 0 0;flex-wrap:wrap;">'
+    for i, s in enumerate(sector_heatmap_data):
+        color = sector_colors(s['change'])
+        sign = '+' if s['change'] > 0 else ''
+        left_radius = '10px' if i == 0 else '0'
+        right_radius = '10px' if i == len(sector_heatmap_data)-1 else '0'
+        heatmap_html += f'<div style="background:{color};color:#e0e0e0;font-weight:700;border-top-left-radius:{left_radius};border-bottom-left-radius:{left_radius};border-top-right-radius:{right_radius};border-bottom-right-radius:{right_radius};padding:10px 18px;min-width:90px;text-align:center;box-shadow:0 2px 8px #0001;font-size:1.08em;border-right:1.5px solid #232;">'
+        heatmap_html += f'<span style="color:#e0e0e0;font-weight:700;">{s["sector"]}</span><br>'
+        heatmap_html += f'<span style="font-size:0.97em;font-weight:700;color:#e0e0e0;">{sign}{s["change"]:.2f}%</span>'
+        heatmap_html += '</div>'
     heatmap_html += '</div>'
-heatmap_html += '</div>'
-
-# --- NAVBAR: StockCore altına ---
-navbar_options = ["Home", "Market Movers", "News", "ETFs", "Stock Heatmap"]
-selected_nav = st.radio("", navbar_options, horizontal=True, label_visibility="collapsed")
+    return heatmap_html
 
 # --- STOCK HEATMAP WIDGET ---
-if selected_nav == "Stock Heatmap":
+def render_stock_heatmap():
     st.subheader("Stock Heatmap (S&P 500)")
     st.markdown("""
     <div style="width:100%;height:600px;">
@@ -371,216 +1407,150 @@ today_events = [
     {"time": "17:00", "country": "🇪🇺", "title": "ECB Rate Decision"},
     {"time": "18:00", "country": "🇬🇧", "title": "BoE Gov. Speech"},
 ]
-econ_events_html = '<div class="econ-events-banner">'
-econ_events_html += '<div class="econ-events-title">Today\'s Major Economic Events</div>'
-for event in today_events:
-    econ_events_html += (
-        f'<div class="econ-event-row">'
-        f'<span class="econ-event-flag">{event["country"]}</span>'
-        f'<span class="econ-event-time">{event["time"]}</span>'
-        f'<span class="econ-event-title">{event["title"]}</span>'
-        f'</div>'
-    )
-if vix_html:
-    econ_events_html += vix_html
+def render_econ_banner():
+    vix_html = get_vix_html()
+    econ_events_html = '<div class="econ-events-banner">'
+    econ_events_html += '<div class="econ-events-title">Today\'s Major Economic Events</div>'
+    for event in today_events:
+        econ_events_html += (
+            f'<div class="econ-event-row">'
+            f'<span class="econ-event-flag">{event["country"]}</span>'
+            f'<span class="econ-event-time">{event["time"]}</span>'
+            f'<span class="econ-event-title">{event["title"]}</span>'
+            f'</div>'
+        )
+    if vix_html:
+        econ_events_html += vix_html
 
-st.markdown(css_econ_events, unsafe_allow_html=True)
-st.markdown(econ_events_html, unsafe_allow_html=True)
+    st.markdown(css_econ_events, unsafe_allow_html=True)
+    st.markdown(econ_events_html, unsafe_allow_html=True)
 
-# --- HEATMAP ANA SAYFADA ve ANA NAV BLOKLARI ---
-if selected_nav == "Home":
-    # ... diğer ana sayfa içeriği ...
-    # Tabloyu ve diğer ana içerikleri burada bırak
-    # En alta heatmap başlığı ve kutuları ekle
+# --- SEKTÖR HEATMAP ve SAYFA FONKSİYONLARI ---
+def render_sector_heatmap():
+    heatmap_html = get_sector_heatmap_html()
     st.markdown("""
     <div style='margin-top:48px; margin-bottom:0;'>
       <h3 style='margin-bottom:10px;color:#fff;font-weight:800;'>Sectoral Heatmaps</h3>
       {heatmap}
     </div>
     """.replace('{heatmap}', heatmap_html), unsafe_allow_html=True)
-elif selected_nav == "News":
+
+def render_news():
     st.subheader('📰 Latest Market News')
-    feed_url = "https://news.google.com/rss/search?q=stock+market"
-    import feedparser
-    feed = feedparser.parse(feed_url)
-    if feed.entries:
-        for entry in feed.entries[:12]:
-            title = entry.title
-            link = entry.link
-            summary = entry.summary if hasattr(entry, 'summary') else ''
-            summary_short = summary[:110] + '...' if len(summary) > 110 else summary
-            parsed_url = urllib.parse.urlparse(link)
-            domain = parsed_url.netloc.replace('www.', '')
+    news_entries = load_news(tuple(get_watchlist()))
+    categories = ["All"] + sorted({entry["category"] for entry in news_entries})
+    category = st.radio("Category", categories, horizontal=True, label_visibility="collapsed", key="news_category")
+    shown = [entry for entry in news_entries if category in ("All", entry["category"])][:NEWS_PAGE_SIZE]
+    if shown:
+        for entry in shown:
+            tags = "".join(f" · {ticker}" for ticker in entry.get('tickers', []))
             st.markdown(f"""
             <div style='margin-bottom:18px;'>
-                <a href='{link}' target='_blank' style='font-size:1.08em;font-weight:700;color:#6ee26e;text-decoration:none;'>{title}</a><br>
-                <span style='font-size:0.97em;color:#888;'>{domain}</span><br>
-                <span style='font-size:0.97em;color:#b5b5b5;font-style:italic;'>{summary_short}</span>
+                <a href='{entry['link']}' target='_blank' style='font-size:1.08em;font-weight:700;color:#6ee26e;text-decoration:none;'>{entry['title']}</a><br>
+                <img src='{entry['favicon']}' style='width:14px;height:14px;vertical-align:middle;margin-right:4px;'/>
+                <span style='font-size:0.97em;color:#888;'>{entry['domain']} · {entry['category']}{tags}</span><br>
+                <span style='font-size:0.97em;color:#b5b5b5;font-style:italic;'>{entry['summary']}</span>
             </div>
             """, unsafe_allow_html=True)
     else:
         st.info("No news found.")
-elif selected_nav == "Market Movers":
+    st.caption(
+        f"News index: {len(news_entries)} stories · {news_stats['requests']} feed request(s), "
+        f"{news_stats['not_modified']} not modified, {news_stats['unchanged']} unchanged, "
+        f"{news_stats['duplicates']} duplicate(s) dropped since server start"
+    )
+
+MOVERS_SAMPLE = pd.DataFrame({
+    'Symbol': ['AAPL', 'MSFT'],
+    'Change %': ['+2.5%', '-1.2%']
+})
+
+def render_market_movers():
     st.subheader('Market Movers (US)')
     try:
+        movers, _ = read_snapshot("movers")
         movers_tab = st.tabs(["Gainers", "Losers", "Actives"])
-        movers_types = ['gainers', 'losers', 'actives']
         for i, tab in enumerate(movers_tab):
             with tab:
-                df = get_yahoo_movers(movers_types[i])
+                entry = (movers or {}).get(MOVER_TYPES[i])
+                df = entry["df"] if entry else pd.DataFrame()
                 if not df.empty:
-                    df = df.reset_index(drop=True)  # Index sütununu kaldır
-                    if 'Unnamed: 0' in df.columns:
-                        df = df.drop(columns=['Unnamed: 0'])
-                    # Sade ve okunaklı sayı formatı uygula
-                    for col in df.columns:
-                        if any(x in col.lower() for x in ['price', 'change', 'close', 'open', 'low', 'high']):
-                            try:
-                                df[col] = df[col].apply(lambda x: f"{float(str(x).replace(',','')):,.2f}" if pd.notnull(x) and str(x).replace('.','',1).replace('-','',1).replace(',','').replace('%','').isdigit() else x)
-                            except Exception:
-                                pass
-                        if 'volume' in col.lower():
-                            def fmt_vol(val):
-                                try:
-                                    v = float(str(val).replace(',',''))
-                                    if v >= 1e9:
-                                        return f"{v/1e9:.2f}B"
-                                    elif v >= 1e6:
-                                        return f"{v/1e6:.2f}M"
-                                    elif v >= 1e3:
-                                        return f"{v/1e3:.2f}K"
-                                    else:
-                                        return f"{v:.0f}"
-                                except:
-                                    return val
-                            df[col] = df[col].apply(fmt_vol)
-                        if 'market cap' in col.lower():
-                            def fmt_mc(val):
-                                try:
-                                    v = float(str(val).replace(',',''))
-                                    if v >= 1e9:
-                                        return f"{v/1e9:.2f}B"
-                                    elif v >= 1e6:
-                                        return f"{v/1e6:.2f}M"
-                                    else:
-                                        return f"{v:.0f}"
-                                except:
-                                    return val
-                            df[col] = df[col].apply(fmt_mc)
+                    st.caption(movers_age_caption(entry))
+                    df = formatted_movers(MOVER_TYPES[i], entry)
                     # Hangi sütun varsa onu renklendir
-                    change_col = None
-                    for col in ['% Change', 'Change %']:
-                        if col in df.columns:
-                            change_col = col
-                            break
-                    if change_col:
-                        def color_mover(val):
-                            try:
-                                v = float(str(val).replace('%','').replace(',',''))
-                                if v > 0:
-                                    return 'color: #188038; font-weight: bold;'
-                                elif v < 0:
-                                    return 'color: #d93025; font-weight: bold;'
-                            except:
-                                pass
-                            return ''
-                        styled = df.style.applymap(color_mover, subset=[change_col])
-                        st.dataframe(styled, use_container_width=True, hide_index=True)
-                    else:
-                        st.dataframe(df, use_container_width=True, hide_index=True)
+                    st.dataframe(style_pnl(df, ['% Change', 'Change %']), use_container_width=True, hide_index=True)
                 else:
                     st.warning("No data found. Showing example data.")
-                    test_df = pd.DataFrame({
-                        'Symbol': ['AAPL', 'MSFT'],
-                        'Change %': ['+2.5%', '-1.2%']
-                    })
-                    test_df = test_df.reset_index(drop=True)
-                    def color_mover(val):
-                        try:
-                            v = float(str(val).replace('%','').replace(',',''))
-                            if v > 0:
-                                return 'color: #188038; font-weight: bold;'
-                            elif v < 0:
-                                return 'color: #d93025; font-weight: bold;'
-                        except:
-                            pass
-                        return ''
-                    styled = test_df.style.applymap(color_mover, subset=['Change %'])
-                    st.dataframe(styled, use_container_width=True, hide_index=True)
+                    st.dataframe(style_pnl(MOVERS_SAMPLE, ['Change %']), use_container_width=True, hide_index=True)
     except Exception as e:
         st.error(f"Error loading Market Movers: {e}")
-        test_df = pd.DataFrame({
-            'Symbol': ['AAPL', 'MSFT'],
-            'Change %': ['+2.5%', '-1.2%']
-        })
-        test_df = test_df.reset_index(drop=True)
-        def color_mover(val):
-            try:
-                v = float(str(val).replace('%','').replace(',',''))
-                if v > 0:
-                    return 'color: #188038; font-weight: bold;'
-                elif v < 0:
-                    return 'color: #d93025; font-weight: bold;'
-            except:
-                pass
-            return ''
-        styled = test_df.style.applymap(color_mover, subset=['Change %'])
-        st.dataframe(styled, use_container_width=True, hide_index=True)
-elif selected_nav == "ETFs":
+        st.dataframe(style_pnl(MOVERS_SAMPLE, ['Change %']), use_container_width=True, hide_index=True)
+
+# --- ETF VERİLERİ ---
+etf_list = [
+    {"Symbol": "SPY", "Name": "SPDR S&P 500 ETF Trust"},
+    {"Symbol": "QQQ", "Name": "Invesco QQQ Trust"},
+    {"Symbol": "IWM", "Name": "iShares Russell 2000 ETF"},
+    {"Symbol": "VTI", "Name": "Vanguard Total Stock Market ETF"},
+    {"Symbol": "DIA", "Name": "SPDR Dow Jones Industrial Average ETF Trust"},
+    {"Symbol": "GLD", "Name": "SPDR Gold Shares"},
+    {"Symbol": "TLT", "Name": "iShares 20+ Year Treasury Bond ETF"},
+    {"Symbol": "XLF", "Name": "Financial Select Sector SPDR Fund"},
+    {"Symbol": "XLE", "Name": "Energy Select Sector SPDR Fund"},
+    {"Symbol": "XLY", "Name": "Consumer Discretionary Select Sector SPDR Fund"},
+    {"Symbol": "XLC", "Name": "Communication Services Select Sector SPDR Fund"},
+    {"Symbol": "XLI", "Name": "Industrial Select Sector SPDR Fund"},
+    {"Symbol": "XLV", "Name": "Health Care Select Sector SPDR Fund"},
+    {"Symbol": "ARKK", "Name": "ARK Innovation ETF"},
+    {"Symbol": "EEM", "Name": "iShares MSCI Emerging Markets ETF"},
+]
+
+ETF_CHUNK_SIZE = int(os.environ.get("TRADEBOX_ETF_CHUNK_SIZE", 50))
+
+def download_etf_chunk(symbols):
+    bars = yf_download(symbols, period="1d", interval="1m", group_by="column",
+                       auto_adjust=False, progress=False, threads=ETF_CHUNK_SIZE // 5 or 1)
+    if bars.empty:
+        return pd.DataFrame(columns=symbols, dtype=float), pd.DataFrame(columns=symbols, dtype=float)
+    closes, volumes = bars['Close'], bars['Volume']
+    if isinstance(closes, pd.Series):
+        closes, volumes = closes.to_frame(name=symbols[0]), volumes.to_frame(name=symbols[0])
+    return closes.reindex(columns=symbols), volumes.reindex(columns=symbols)
+
+@cached_loader("etf_quotes", ttl=60)
+def load_etf_quotes(symbols):
+    chunks = chunked(symbols, ETF_CHUNK_SIZE)
+    frames = get_io_loop().map_blocking(download_etf_chunk, chunks)
+    closes = pd.concat([c for c, v in frames], axis=1).astype(float)
+    volumes = pd.concat([v for c, v in frames], axis=1).astype(float)
+    last_price = closes.ffill().iloc[-1] if len(closes) else pd.Series(np.nan, index=closes.columns)
+    first_price = closes.bfill().iloc[0] if len(closes) else pd.Series(np.nan, index=closes.columns)
+    # Same rules as the old per-symbol loop: change needs two bars, volume is the latest bar's
+    change = ((last_price - first_price) / first_price.where(first_price != 0) * 100).where(closes.count() > 1)
+    volume = volumes.where(closes.notna()).ffill().iloc[-1] if len(closes) else pd.Series(np.nan, index=closes.columns)
+    return pd.DataFrame({"Last Price": last_price, "% Change": change, "Volume": volume})
+
+def build_etf_table():
+    # Raw numbers; formatting happens at render time
+    etf_df = pd.DataFrame(etf_list)
+    quotes = load_etf_quotes(tuple(etf_df['Symbol']))
+    return etf_df.join(quotes[['Last Price', '% Change', 'Volume']], on='Symbol')
+
+@traced("table.format")
+def format_etf_table(etf_df):
+    return etf_df.assign(**{
+        'Last Price': format_fixed(etf_df['Last Price'], na="-"),
+        '% Change': format_fixed(etf_df['% Change'], sign=True, suffix="%", na="-"),
+        'Volume': format_fixed(etf_df['Volume'], decimals=0, na="-"),
+    })
+
+def render_etfs():
     st.subheader('Most Traded US ETFs')
     try:
-        etf_list = [
-            {"Symbol": "SPY", "Name": "SPDR S&P 500 ETF Trust"},
-            {"Symbol": "QQQ", "Name": "Invesco QQQ Trust"},
-            {"Symbol": "IWM", "Name": "iShares Russell 2000 ETF"},
-            {"Symbol": "VTI", "Name": "Vanguard Total Stock Market ETF"},
-            {"Symbol": "DIA", "Name": "SPDR Dow Jones Industrial Average ETF Trust"},
-            {"Symbol": "GLD", "Name": "SPDR Gold Shares"},
-            {"Symbol": "TLT", "Name": "iShares 20+ Year Treasury Bond ETF"},
-            {"Symbol": "XLF", "Name": "Financial Select Sector SPDR Fund"},
-            {"Symbol": "XLE", "Name": "Energy Select Sector SPDR Fund"},
-            {"Symbol": "XLY", "Name": "Consumer Discretionary Select Sector SPDR Fund"},
-            {"Symbol": "XLC", "Name": "Communication Services Select Sector SPDR Fund"},
-            {"Symbol": "XLI", "Name": "Industrial Select Sector SPDR Fund"},
-            {"Symbol": "XLV", "Name": "Health Care Select Sector SPDR Fund"},
-            {"Symbol": "ARKK", "Name": "ARK Innovation ETF"},
-            {"Symbol": "EEM", "Name": "iShares MSCI Emerging Markets ETF"},
-        ]
-        etf_df = pd.DataFrame(etf_list)
-        def get_etf_data(symbol):
-            try:
-                t = yf.Ticker(symbol)
-                hist = t.history(period="1d", interval="1m")
-                last_price = hist['Close'].iloc[-1] if not hist.empty else None
-                change = None
-                if not hist.empty and len(hist) > 1:
-                    prev = hist['Close'].iloc[0]
-                    change = ((last_price - prev) / prev) * 100 if prev else None
-                volume = hist['Volume'].iloc[-1] if not hist.empty else None
-                return last_price, change, volume
-            except:
-                return None, None, None
-        import time as _time
-        etf_df['Last Price'] = None
-        etf_df['% Change'] = None
-        etf_df['Volume'] = None
-        for i, row in etf_df.iterrows():
-            price, chg, vol = get_etf_data(row['Symbol'])
-            etf_df.at[i, 'Last Price'] = f"{price:,.2f}" if price is not None else "-"
-            etf_df.at[i, '% Change'] = f"{chg:+.2f}%" if chg is not None else "-"
-            etf_df.at[i, 'Volume'] = f"{int(vol):,}" if vol is not None else "-"
-            _time.sleep(0.1)
-        def etf_color(val):
-            try:
-                v = float(str(val).replace('%',''))
-                if v > 0:
-                    return 'color: #188038; font-weight: bold;'
-                elif v < 0:
-                    return 'color: #d93025; font-weight: bold;'
-            except:
-                pass
-            return ''
-        styled = etf_df.style.applymap(etf_color, subset=['% Change'])
+        etf_df, _ = read_snapshot("etf_quotes")
+        if etf_df is None:
+            raise RuntimeError("ETF snapshot is not available yet")
+        styled = style_pnl(format_etf_table(etf_df), ['% Change'], numbers=etf_df)
         st.dataframe(styled, use_container_width=True, hide_index=True)
     except Exception as e:
         st.error(f"Error loading ETFs: {e}")
@@ -593,48 +1563,196 @@ elif selected_nav == "ETFs":
         })
         st.dataframe(test_etf)
 
-# Ticker list (move this up before async scraping)
-tickers = [
+# --- WATCHLIST ---
+# The watchlist is a plain text file (one ticker per line, '#' comments) that is
+# edited from the Home page; DEFAULT_TICKERS are used until one is saved.
+DEFAULT_TICKERS = [
     'COIN','MSTR','MU','NEE','QCOM','MSFT','WMT','LMT','NFLX','C','PLTR','IONQ','RGTI','CEG','LLY',
     'QQQ','DELL','TLT','NVO','RIOT','GOOGL','NVDA','AMZN','TSLA','MRVL','AA','AAL','AMD','FCX',
     'ONON'  # Added ONON
 ]
+WATCHLIST_PATH = os.environ.get("TRADEBOX_WATCHLIST", os.path.join(DATA_DIR, "watchlist.txt"))
+WATCHLIST_MAX_SYMBOLS = 5000
+TICKER_PATTERN = re.compile(r'^[A-Z0-9^][A-Z0-9.=-]{0,14}$')
+
+def parse_watchlist(text):
+    lines = [line.split('#', 1)[0] for line in text.splitlines()]
+    lines = [line for line in lines if line.strip()]
+    header = [cell.strip().strip('"\'').upper() for cell in lines[0].split(',')] if lines else []
+    column = next((header.index(name) for name in ("SYMBOL", "TICKER") if name in header), None)
+    if column is not None:
+        # CSV export with a Symbol/Ticker column: only that column is read
+        tokens = [(row.split(',') + [''] * column)[column] for row in lines[1:]]
+    else:
+        tokens = [token for line in lines for token in re.split(r'[\s,;]+', line)]
+    symbols = (token.strip().strip('"\'').upper() for token in tokens)
+    return list(dict.fromkeys(s for s in symbols if TICKER_PATTERN.match(s)))[:WATCHLIST_MAX_SYMBOLS]
 
-nest_asyncio.apply()
+@st.cache_resource
+def _watchlist_state():
+    return {"mtime": None, "symbols": list(DEFAULT_TICKERS)}
 
-async def fetch_google_data(session, ticker):
-    for suffix in [':NASDAQ', ':NYSE']:
-        url = f"https://www.google.com/finance/quote/{ticker}{suffix}"
-        headers = {"User-Agent": "Mozilla/5.0"}
+def get_watchlist():
+    # The file is only re-read when it changed on disk
+    state = _watchlist_state()
+    try:
+        mtime = os.path.getmtime(WATCHLIST_PATH)
+    except OSError:
+        return list(DEFAULT_TICKERS)
+    if mtime != state["mtime"]:
+        with open(WATCHLIST_PATH) as f:
+            state["symbols"] = parse_watchlist(f.read())
+        state["mtime"] = mtime
+    return list(state["symbols"])
+
+def save_watchlist(symbols):
+    os.makedirs(os.path.dirname(WATCHLIST_PATH) or ".", exist_ok=True)
+    with open(WATCHLIST_PATH + ".tmp", 'w') as f:
+        f.write("\n".join(symbols) + "\n")
+    os.replace(WATCHLIST_PATH + ".tmp", WATCHLIST_PATH)
+
+def render_watchlist_editor(symbols):
+    with st.expander(f"Edit watchlist ({len(symbols)} symbols)"):
+        text = st.text_area("Tickers, one per line or comma separated", "\n".join(symbols), height=160)
+        upload = st.file_uploader("Or load a .txt / .csv file", type=["txt", "csv"])
+        if st.button("Save watchlist"):
+            new_symbols = parse_watchlist(upload.getvalue().decode("utf-8", "ignore") if upload else text)
+            if not new_symbols:
+                st.warning("No valid tickers found.")
+            else:
+                save_watchlist(new_symbols)
+                st.rerun()
+
+# --- COMPANY NAME INDEX ---
+# Company names practically never change, so they live in a small JSON index on
+# disk (ticker -> exchange, name). Only unknown tickers are scraped inline; stale
+# entries are re-scraped in the background while the stored name keeps showing.
+GOOGLE_EXCHANGES = ['NASDAQ', 'NYSE']
+NAME_INDEX_PATH = os.path.join(DATA_DIR, "company_names.json")
+NAME_INDEX_TTL = 30 * 24 * 3600
+NAME_MISS_TTL = 24 * 3600  # tickers Google had no page for are retried daily
+name_index_stats = process_counters("name_index", ("hits", "scraped", "google_requests", "background_refreshes"))
+
+async def fetch_google_data(session, ticker, exchanges):
+    import aiohttp
+    answered = False
+    for exchange in exchanges:
+        url = f"https://www.google.com/finance/quote/{ticker}:{exchange}"
         try:
-            async with session.get(url, headers=headers, timeout=5) as r:
-                text = await r.text()
-                soup = BeautifulSoup(text, "html.parser")
-                price = soup.find("div", class_="YMlKec fxKbKc")
-                name = soup.find("div", class_="zzDege")
-                close_val = float(price.text.replace(",", "").replace("$", "")) if price else None
-                company_name = name.text.strip() if name else ''
+            async with get_upstream_limiter("www.google.com").aslot():
+                name_index_stats["google_requests"] += 1
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=5)) as r:
+                    if r.status == 429:
+                        raise UpstreamThrottled(url)
+                    # Bytes on the wire; text() decodes the body already read
+                    trace_event("bytes", len(await r.read()))
+                    text = await r.text()
+                answered = True
+                close_val, company_name = parse_google_quote(text)
                 if close_val:
-                    return ticker, close_val, company_name
+                    return ticker, exchange, close_val, company_name
         except Exception:
             continue
-    return ticker, None, ''
+    # None (rather than '') when Google never answered, so the miss isn't remembered
+    return ticker, None, None, '' if answered else None
+
+async def fetch_all_google_data(session, lookups):
+    tasks = [fetch_google_data(session, ticker, exchanges) for ticker, exchanges in lookups]
+    return await asyncio.gather(*tasks)
+
+class CompanyNameIndex:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        # ticker -> Future of the inline scrape in progress, so concurrent sessions scrape it once
+        self._scraping = {}
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def _exchanges(self, ticker):
+        # The exchange that worked last time goes first, so a listed ticker costs one request
+        known = self.entries.get(ticker, {}).get("exchange")
+        return [known] + [e for e in GOOGLE_EXCHANGES if e != known] if known else GOOGLE_EXCHANGES
+
+    def _is_stale(self, entry, now):
+        ttl = NAME_INDEX_TTL if entry.get("exchange") else NAME_MISS_TTL
+        return now - entry.get("updated", 0) > ttl
 
-async def fetch_all_google_data(tickers):
-    async with aiohttp.ClientSession() as session:
-        tasks = [fetch_google_data(session, ticker) for ticker in tickers]
-        results = await asyncio.gather(*tasks)
-    return results
+    @traced("google.scrape")
+    def scrape(self, symbols):
+        client = get_async_http_client()
+        lookups = [(t, self._exchanges(t)) for t in symbols]
+        results = client.run(fetch_all_google_data(client.session, lookups))
+        now = time.time()
+        with self._lock:
+            for ticker, exchange, _, company_name in results:
+                if company_name is None or (exchange is None and self.entries.get(ticker, {}).get("exchange")):
+                    # Network errors/throttling are not remembered and never overwrite a known name
+                    continue
+                self.entries[ticker] = {"exchange": exchange, "name": company_name, "updated": now}
+            self._save()
+        name_index_stats["scraped"] += len(symbols)
 
-# Fetch all company names and close prices in parallel
-loop = asyncio.get_event_loop()
-google_results = loop.run_until_complete(fetch_all_google_data(tickers))
-last_official_close_dict = {t: c for t, c, n in google_results}
-company_names = {t: n for t, c, n in google_results}
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
+
+    def _refresh_in_background(self, symbols):
+        with self._lock:
+            symbols = [t for t in symbols if t not in self._refreshing]
+            self._refreshing.update(symbols)
+        if not symbols:
+            return
+        name_index_stats["background_refreshes"] += 1
+        future = get_io_loop().submit_blocking(self.scrape, symbols)
+        future.add_done_callback(lambda _: self._refresh_done(symbols))
+
+    def _refresh_done(self, symbols):
+        with self._lock:
+            self._refreshing.difference_update(symbols)
+
+    def _scrape_missing(self, symbols):
+        with self._lock:
+            waits = {self._scraping[t] for t in symbols if t in self._scraping}
+            claimed = [t for t in symbols if t not in self._scraping and t not in self.entries]
+            flight = Future()
+            self._scraping.update(dict.fromkeys(claimed, flight))
+        if claimed:
+            try:
+                self.scrape(claimed)
+            finally:
+                with self._lock:
+                    for t in claimed:
+                        del self._scraping[t]
+                flight.set_result(None)
+        for other in waits:
+            other.result()
+
+    def names(self, symbols):
+        now = time.time()
+        missing = [t for t in symbols if t not in self.entries]
+        if missing:
+            self._scrape_missing(missing)
+        stale = [t for t in symbols if t not in missing and self._is_stale(self.entries[t], now)]
+        if stale:
+            self._refresh_in_background(stale)
+        name_index_stats["hits"] += len(symbols) - len(missing)
+        return {t: self.entries.get(t, {}).get("name", '') for t in symbols}
+
+@st.cache_resource
+def get_name_index():
+    return CompanyNameIndex(NAME_INDEX_PATH)
+
+def load_company_names(symbols):
+    return get_name_index().names(list(symbols))
 
 # --- MODERN INDEX CARDS ---
-import yfinance as yf
-import time
 
 major_indices = {
     'NASDAQ 100': '^NDX',
@@ -646,94 +1764,107 @@ major_indices = {
     'US10Y': '^TNX',
 }
 
-def get_index_time(symbol):
-    # Try to get the latest time for the index (using yfinance), show as GMT+3 (Istanbul)
-    try:
-        ticker = yf.Ticker(symbol)
-        hist = ticker.history(period="1d", interval="1m")
-        if not hist.empty:
-            ts = hist.index[-1]
-            istanbul = pytz.timezone('Europe/Istanbul')
-            ts_ist = ts.tz_localize('UTC').astimezone(istanbul) if ts.tzinfo is None else ts.astimezone(istanbul)
-            return ts_ist.strftime('%H:%M')
-    except Exception:
-        pass
-    return "-"
+def lttb(y, threshold):
+    # Largest-Triangle-Three-Buckets: keeps the visual shape of a long series in `threshold` points
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    keep = [0]
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nxt = slice(edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n)
+        next_x, next_y = (nxt.start + (nxt.stop - 1)) / 2, y[nxt].mean()
+        a = keep[-1]
+        x = np.arange(lo, hi)
+        area = np.abs((a - next_x) * (y[lo:hi] - y[a]) - (a - x) * (next_y - y[a]))
+        keep.append(lo + int(np.argmax(area)))
+    keep.append(n - 1)
+    return np.array(keep)
 
-def get_sparkline_svg(prices, width=80, height=24, color="#fff"):
-    if prices is None or len(prices) < 2:
+def get_sparkline_svg(prices, width=80, height=24, color="#fff", max_points=None, css_class=None):
+    prices = np.asarray(prices, dtype=float) if prices is not None else np.empty(0)
+    prices = prices[~np.isnan(prices)]
+    if len(prices) < 2:
         return ""
-    prices = np.array(prices)
+    x = np.linspace(2, width-2, len(prices))
+    if max_points:
+        keep = lttb(prices, max_points)
+        x, prices = x[keep], prices[keep]
     # Normalize to [0, height]
     min_p, max_p = np.min(prices), np.max(prices)
     if max_p - min_p == 0:
         y = np.full_like(prices, height//2)
     else:
         y = height - ((prices - min_p) / (max_p - min_p) * (height-4) + 2)
-    x = np.linspace(2, width-2, len(prices))
-    points = " ".join(f"{int(xi)},{int(yi)}" for xi, yi in zip(x, y))
-    svg = f'<svg width="{width}" height="{height}" viewBox="0 0 {width} {height}" fill="none" xmlns="http://www.w3.org/2000/svg"><polyline points="{points}" fill="none" stroke="{color}" stroke-width="2"/></svg>'
+    points = " ".join(f"{xi:.1f},{yi:.1f}" for xi, yi in zip(x, y))
+    class_attr = f' class="{css_class}" preserveAspectRatio="none"' if css_class else ''
+    svg = f'<svg{class_attr} width="{width}" height="{height}" viewBox="0 0 {width} {height}" fill="none" xmlns="http://www.w3.org/2000/svg"><polyline points="{points}" fill="none" stroke="{color}" stroke-width="2" vector-effect="non-scaling-stroke"/></svg>'
     return svg
 
-@st.cache_data(ttl=300)
-def get_index_prices_and_changes():
-    prices = {}
-    changes = {}
-    for name, symbol in major_indices.items():
-        try:
-            ticker = yf.Ticker(symbol)
-            hist = ticker.history(period="2d", interval="1m")['Close']
-            if not hist.empty:
-                last_price = hist.iloc[-1]
-                daily = ticker.history(period="2d", interval="1d")['Close']
-                if len(daily) >= 2:
-                    prev_close = daily.iloc[-2]
-                else:
-                    prev_close = None
-                prices[name] = last_price
-                if prev_close and prev_close != 0:
-                    change = ((last_price - prev_close) / prev_close) * 100
-                    changes[name] = change
-                else:
-                    changes[name] = None
-            else:
-                prices[name] = None
-                changes[name] = None
-        except Exception:
-            prices[name] = None
-            changes[name] = None
-    return prices, changes
+VIX_SYMBOL = '^VIX'
+# Indices that Yahoo sometimes leaves empty, filled from a tracking ETF fetched in the same batch
+INDEX_FALLBACKS = {'Russell 2000': 'IWM'}
+INDEX_SNAPSHOT_COLUMNS = ["Symbol", "Price", "Previous Close", "Change %", "Time"]
+istanbul = pytz.timezone('Europe/Istanbul')
 
-index_prices, index_changes = get_index_prices_and_changes()
+def index_row(symbol, closes):
+    # Last bar is the price; the last bar of the previous day is the previous close
+    closes = closes.dropna()
+    if closes.empty:
+        return [symbol, np.nan, np.nan, np.nan, None]
+    index = closes.index if closes.index.tz is not None else closes.index.tz_localize('UTC')
+    days = index.normalize()
+    price = closes.iloc[-1]
+    earlier = closes[days < days[-1]]
+    prev_close = earlier.iloc[-1] if len(earlier) and earlier.iloc[-1] != 0 else np.nan
+    return [symbol, price, prev_close, (price - prev_close) / prev_close * 100, index[-1].astimezone(istanbul)]
 
-# Russell 2000 için fallback uygula
-if index_prices.get('Russell 2000') is None and index_prices.get('Russell 2000 ETF') is not None:
-    index_prices['Russell 2000'] = index_prices['Russell 2000 ETF']
-    index_changes['Russell 2000'] = index_changes['Russell 2000 ETF']
-
-# --- MODERN DARK HEADER WITH SEARCH ---
-# (Bu bölümü tamamen kaldır)
+@cached_loader("index_snapshot", ttl=60)
+def load_index_snapshot():
+    # One batched 1-minute download for every index, the VIX and the fallback ETFs
+    names = {**major_indices, 'VIX': VIX_SYMBOL}
+    symbols = list(dict.fromkeys([*names.values(), *INDEX_FALLBACKS.values()]))
+    bars = yf_download(symbols, period="2d", interval="1m", group_by="column",
+                       auto_adjust=False, progress=False, threads=True)
+    closes = bars['Close'] if not bars.empty else pd.DataFrame(columns=symbols, dtype=float)
+    if isinstance(closes, pd.Series):
+        closes = closes.to_frame(name=symbols[0])
+    closes = closes.reindex(columns=symbols).astype(float)
+    rows = {symbol: index_row(symbol, closes[symbol]) for symbol in symbols}
+    for name, etf in INDEX_FALLBACKS.items():
+        if pd.isna(rows[names[name]][1]):
+            names[name] = etf
+    return pd.DataFrame([rows[symbol] for symbol in names.values()], index=list(names), columns=INDEX_SNAPSHOT_COLUMNS)
 
 # --- MODERN TICKER TAPE (SCROLLING INDEX BAR) ---
-ticker_items = []
-for name, symbol in major_indices.items():
-    price = index_prices.get(name)
-    change = index_changes.get(name)
-    if change is not None:
-        arrow = "▲" if change > 0 else "▼" if change < 0 else ""
-        color = "#6ee26e" if change > 0 else "#ff5c5c" if change < 0 else "#ccc"
-        sign = "+" if change > 0 else ""
-        change_str = f"{arrow} {sign}{change:.2f}%"
-    else:
-        color = "#ccc"
-        change_str = "N/A"
-    price_str = f"{price:,.2f}" if price is not None else "N/A"
-    ticker_items.append(
-        f"<span class='ticker-item' style='color:{color};'><b>{name}</b> {price_str} <span>{change_str}</span></span>"
-    )
-ticker_tape_html = " ".join(ticker_items)
+def render_ticker_tape():
+    index_snapshot, _ = read_snapshot("index_snapshot")
+    if index_snapshot is None:
+        index_snapshot = pd.DataFrame(index=list(major_indices), columns=INDEX_SNAPSHOT_COLUMNS)
+
+    ticker_items = []
+    for name in major_indices:
+        price, change, bar_time = index_snapshot.loc[name, ["Price", "Change %", "Time"]]
+        price = None if pd.isna(price) else price
+        change = None if pd.isna(change) else change
+        if change is not None:
+            arrow = "▲" if change > 0 else "▼" if change < 0 else ""
+            color = "#6ee26e" if change > 0 else "#ff5c5c" if change < 0 else "#ccc"
+            sign = "+" if change > 0 else ""
+            change_str = f"{arrow} {sign}{change:.2f}%"
+        else:
+            color = "#ccc"
+            change_str = "N/A"
+        price_str = f"{price:,.2f}" if price is not None else "N/A"
+        # Son bar saati, İstanbul saatiyle (GMT+3)
+        time_str = f" <span class='ticker-time'>{bar_time:%H:%M}</span>" if isinstance(bar_time, pd.Timestamp) else ""
+        ticker_items.append(
+            f"<span class='ticker-item' style='color:{color};'><b>{name}</b> {price_str} <span>{change_str}</span>{time_str}</span>"
+        )
+    ticker_tape_html = " ".join(ticker_items)
 
-st.markdown(f'''
+    st.markdown(f'''
 <style>
 .ticker-tape {{
   width: 100%;
@@ -763,6 +1894,11 @@ st.markdown(f'''
   font-weight: 500;
   letter-spacing: 0.5px;
 }}
+.ticker-time {{
+  color: #999;
+  font-size: 0.8em;
+  font-weight: 400;
+}}
 @media (max-width: 700px) {{
   .ticker-tape {{ font-size: 0.98em; padding: 7px 0 7px 0; height: 36px; }}
   .ticker-item {{ margin: 0 14px 0 0; }}
@@ -772,9 +1908,12 @@ st.markdown(f'''
   <div class="ticker-tape-inner">{ticker_tape_html}</div>
 </div>
 ''', unsafe_allow_html=True)
+    if index_snapshot["Price"].notna().any() and pd.isna(index_snapshot.at['Dow Jones', 'Price']):
+        st.warning("Dow Jones verisi alınamadı.")
 
 # --- TRADE IDEAS CENTERED BELOW INDEX BAR ---
-trade_ideas = [
+# Shown until a trade ideas file exists, see TRADE IDEA ENGINE
+DEFAULT_TRADE_IDEAS = [
     {
         "Ticker": "MRVL",
         "Type": "AL",
@@ -800,39 +1939,102 @@ trade_ideas = [
         "TakeProfit": 12.50,
     },
 ]
-# Update current price and performance for each trade idea
-for idea in trade_ideas:
-    try:
-        ticker = yf.Ticker(idea["Ticker"])
-        hist = ticker.history(period="1d", interval="1m")
-        if not hist.empty:
-            current_price = hist['Close'].iloc[-1]
-            idea["Current Price"] = current_price
-            idea["Performance"] = ((current_price - idea["Price"]) / idea["Price"]) * 100
-        else:
-            idea["Current Price"] = None
-            idea["Performance"] = None
-    except Exception:
-        idea["Current Price"] = None
-        idea["Performance"] = None
 
-def get_sparkline_base64(ticker):
+# --- TRADE IDEA ENGINE ---
+# Ideas are read from a JSON (list of objects) or CSV file with the fields of
+# DEFAULT_TRADE_IDEAS and evaluated as one frame: one batched quote download for
+# current prices and one bar-store sync for the daily bars since the oldest idea
+# (which also covers the sparklines), however many ideas there are.
+TRADE_IDEAS_PATH = os.environ.get("TRADEBOX_TRADE_IDEAS", os.path.join(DATA_DIR, "trade_ideas.json"))
+TRADE_IDEA_COLUMNS = ["Ticker", "Type", "Date", "Price", "StopLoss", "TakeProfit"]
+# "AL" / "SAT" kartlarda alış / satış; anything not listed here is treated as a long idea
+SHORT_TRADE_TYPES = {"SAT", "SELL", "SHORT"}
+
+def normalize_trade_ideas(ideas):
+    ideas = ideas.reindex(columns=TRADE_IDEA_COLUMNS)
+    return ideas.assign(
+        Ticker=ideas["Ticker"].astype(str).str.strip().str.upper(),
+        Type=ideas["Type"].fillna("AL").astype(str).str.strip().str.upper(),
+        # Unparseable dates become NaT and the row is dropped with the other incomplete ones
+        Date=pd.to_datetime(ideas["Date"], errors="coerce", format="mixed").dt.normalize(),
+        **{col: pd.to_numeric(ideas[col], errors='coerce') for col in ["Price", "StopLoss", "TakeProfit"]},
+    ).dropna(subset=["Ticker", "Date", "Price"]).reset_index(drop=True)
+
+def read_trade_ideas(path):
+    if path.endswith(".csv"):
+        return normalize_trade_ideas(pd.read_csv(path))
+    with open(path) as f:
+        return normalize_trade_ideas(pd.DataFrame(json.load(f)))
+
+@st.cache_resource
+def _trade_ideas_state():
+    return {"mtime": None, "ideas": None}
+
+def get_trade_ideas():
+    # Like the watchlist, the file is only re-read when it changed on disk
+    state = _trade_ideas_state()
     try:
-        hist = yf.Ticker(ticker).history(period="1mo", interval="1d")['Close']
-        if hist.empty:
-            return ""
-        fig, ax = plt.subplots(figsize=(3.5, 0.9))
-        ax.plot(hist.values, color="#6ee26e", linewidth=2.5)
-        ax.axis('off')
-        plt.tight_layout(pad=0)
-        buf = io.BytesIO()
-        plt.savefig(buf, format="png", bbox_inches='tight', pad_inches=0, transparent=True)
-        plt.close(fig)
-        buf.seek(0)
-        img_base64 = base64.b64encode(buf.read()).decode()
-        return f'<img src="data:image/png;base64,{img_base64}" class="trade-idea-sparkline-img" />'
-    except Exception:
-        return ""
+        mtime = os.path.getmtime(TRADE_IDEAS_PATH)
+    except OSError:
+        return normalize_trade_ideas(pd.DataFrame(DEFAULT_TRADE_IDEAS))
+    if mtime != state["mtime"]:
+        state["ideas"] = read_trade_ideas(TRADE_IDEAS_PATH)
+        state["mtime"] = mtime
+    return state["ideas"]
+
+def trade_idea_tickers():
+    return tuple(dict.fromkeys(get_trade_ideas()["Ticker"]))
+
+@cached_loader("trade_idea_prices", ttl=30)
+def load_trade_idea_prices(symbols):
+    # Same batched 1-minute download as the watchlist, without the market-cap lookups
+    frames = get_io_loop().map_blocking(quote_chunk, chunked(symbols, YAHOO_CHUNK_SIZE))
+    quotes = pd.concat(frames) if frames else compute_quotes(pd.DataFrame(dtype=float))
+    return quotes["Last Price"].dropna().to_dict()
+
+def trade_idea_window(ideas):
+    start, end = sparkline_window("1mo")
+    if len(ideas):
+        start = min(start, ideas["Date"].min())
+    return start, end
+
+@cached_loader("trade_idea_bars", ttl=3600)
+def load_trade_idea_bars(symbols, start, end):
+    sync_bar_store(symbols, start, end)
+    return load_bar_frame(symbols, start, end, 'High'), load_bar_frame(symbols, start, end, 'Low')
+
+def first_true(mask):
+    # Row of the first True in every column, len(mask) where there is none
+    if len(mask) == 0:
+        return np.zeros(mask.shape[1], dtype=int)
+    return np.where(mask.any(axis=0), mask.argmax(axis=0), len(mask))
+
+def evaluate_trade_ideas(ideas, prices, highs, lows):
+    # Every idea is a column of (bar day x idea) matrices, so the checks are the same few array ops for 3 or 300 ideas
+    entry = ideas["Price"].to_numpy(dtype=float)
+    stop = ideas["StopLoss"].to_numpy(dtype=float)
+    target = ideas["TakeProfit"].to_numpy(dtype=float)
+    current = ideas["Ticker"].map(prices).to_numpy(dtype=float)
+    long = ~ideas["Type"].isin(SHORT_TRADE_TYPES).to_numpy()
+    high = highs.reindex(columns=ideas["Ticker"]).to_numpy(dtype=float)
+    low = lows.reindex(columns=ideas["Ticker"]).to_numpy(dtype=float)
+    # Bars of the entry day count, the entry could have been before that day's high/low
+    active = highs.index.to_numpy()[:, None] >= ideas["Date"].to_numpy()[None, :]
+    stop_day = first_true(active & np.where(long, low <= stop, high >= stop))
+    target_day = first_true(active & np.where(long, high >= target, low <= target))
+    # A day that touched both is counted as stopped out
+    stopped = stop_day < len(highs)
+    stopped &= stop_day <= target_day
+    hit_target = (target_day < len(highs)) & ~stopped
+    bar_days = np.append(highs.index.to_numpy(), np.datetime64('NaT'))
+    return ideas.assign(**{
+        "Current Price": current,
+        "Performance": np.where(long, 1, -1) * (current - entry) / entry * 100,
+        "To Stop %": (stop - current) / current * 100,
+        "To Target %": (target - current) / current * 100,
+        "Status": np.select([stopped, hit_target], ["Stopped out", "Target hit"], "Open"),
+        "Closed On": np.where(stopped, bar_days[stop_day], bar_days[np.minimum(target_day, len(highs))]),
+    })
 
 symbol_to_domain = {
     "NVDA": "nvidia.com",
@@ -841,7 +2043,7 @@ symbol_to_domain = {
     # Diğer semboller için domain ekleyebilirsin
 }
 
-st.markdown("""
+trade_ideas_css = """
 <style>
 .trade-ideas-row-center {
     display: flex;
@@ -927,7 +2129,7 @@ st.markdown("""
   .trade-idea-sparkline-img { height: 32px; margin-top: 8px; }
 }
 </style>
-""", unsafe_allow_html=True)
+"""
 
 # Trade Ideas kartları için Analyst Rating örnek verisi (gerçek API ile entegre edilebilir)
 def get_analyst_rating():
@@ -938,238 +2140,586 @@ def get_analyst_rating():
     if sell < 0: sell = 0
     return buy, hold, sell
 
-trade_ideas_boxes_html = ""
-for idea in trade_ideas:
-    perf = idea.get("Performance")
-    perf_str = f"{perf:+.2f}%" if perf is not None else "N/A"
-    perf_class = "trade-idea-perf-pos" if perf is not None and perf >= 0 else "trade-idea-perf-neg"
-    price_str = f"{idea['Price']:.2f}" if idea.get('Price') is not None else "N/A"
-    curr_str = f"{idea.get('Current Price', 0):.2f}" if idea.get('Current Price') is not None else "N/A"
-    stop_str = f"{idea.get('StopLoss', 0):.2f}" if idea.get('StopLoss') is not None else "N/A"
-    tp_str = f"{idea.get('TakeProfit', 0):.2f}" if idea.get('TakeProfit') is not None else "N/A"
-    sparkline_img = get_sparkline_base64(idea['Ticker'])
-    logo_url = f"https://logo.clearbit.com/{symbol_to_domain.get(idea['Ticker'], 'yahoo.com')}"
-    trade_ideas_boxes_html += (
-        f'<div class="trade-idea-box">'
-        f'<div class="trade-idea-title-row">'
-        f'<img src="{logo_url}" class="trade-idea-logo-img" alt="{idea["Ticker"]} logo"/>'
-        f'<span class="trade-idea-title">Trade Ideas</span>'
-        f'</div>'
-        f'<div class="trade-idea-row"><span class="trade-idea-label">Symbol:</span> {idea["Ticker"]}</div>'
-        f'<div class="trade-idea-row"><span class="trade-idea-label">Action:</span> {idea["Type"]} ({idea["Date"]})</div>'
-        f'<div class="trade-idea-row"><span class="trade-idea-label">Entry Price:</span> {price_str}</div>'
-        f'<div class="trade-idea-row"><span class="trade-idea-label">Stop Loss:</span> {stop_str}</div>'
-        f'<div class="trade-idea-row"><span class="trade-idea-label">Take Profit:</span> {tp_str}</div>'
-        f'<div class="trade-idea-row"><span class="trade-idea-label">Current Price:</span> {curr_str}</div>'
-        f'<div class="trade-idea-row"><span class="trade-idea-label">Performance:</span> <span class="{perf_class}">{perf_str}</span></div>'
-        f'{sparkline_img}'
-        f'</div>'
-    )
+def render_trade_ideas():
+    ideas = get_trade_ideas()
+    if ideas.empty:
+        return
+    tickers = trade_idea_tickers()
+    # Tickers added to the ideas file show N/A until the refresher's next round picks them up
+    trade_idea_prices, _ = read_snapshot("trade_idea_prices")
+    trade_idea_prices = trade_idea_prices or {}
+    if live_interval():
+        trade_idea_prices = {**trade_idea_prices, **live_prices(list(tickers))}
+    highs, lows = load_trade_idea_bars(tickers, *trade_idea_window(ideas))
+    trade_ideas_list = evaluate_trade_ideas(ideas, trade_idea_prices, highs, lows).to_dict('records')
+    st.markdown(trade_ideas_css, unsafe_allow_html=True)
+    sparklines = sparkline_svgs(tickers, css_class="trade-idea-sparkline-img")
+
+    def fmt(value, spec):
+        return "N/A" if pd.isna(value) else format(value, spec)
 
-st.markdown(f"""
+    trade_ideas_boxes_html = ""
+    for idea in trade_ideas_list:
+        perf = idea["Performance"]
+        perf_str = fmt(perf, "+.2f") + ("%" if not pd.isna(perf) else "")
+        perf_class = "trade-idea-perf-pos" if not pd.isna(perf) and perf >= 0 else "trade-idea-perf-neg"
+        price_str = fmt(idea['Price'], ".2f")
+        curr_str = fmt(idea['Current Price'], ".2f")
+        stop_str = f"{fmt(idea['StopLoss'], '.2f')} ({fmt(idea['To Stop %'], '+.1f')}%)" if not pd.isna(idea['To Stop %']) else fmt(idea['StopLoss'], ".2f")
+        tp_str = f"{fmt(idea['TakeProfit'], '.2f')} ({fmt(idea['To Target %'], '+.1f')}%)" if not pd.isna(idea['To Target %']) else fmt(idea['TakeProfit'], ".2f")
+        status_str = idea['Status'] if pd.isna(idea['Closed On']) else f"{idea['Status']} ({idea['Closed On']:%Y-%m-%d})"
+        sparkline_img = sparklines.get(idea['Ticker'], "")
+        logo_url = f"https://logo.clearbit.com/{symbol_to_domain.get(idea['Ticker'], 'yahoo.com')}"
+        trade_ideas_boxes_html += (
+            f'<div class="trade-idea-box">'
+            f'<div class="trade-idea-title-row">'
+            f'<img src="{logo_url}" class="trade-idea-logo-img" alt="{idea["Ticker"]} logo"/>'
+            f'<span class="trade-idea-title">Trade Ideas</span>'
+            f'</div>'
+            f'<div class="trade-idea-row"><span class="trade-idea-label">Symbol:</span> {idea["Ticker"]}</div>'
+            f'<div class="trade-idea-row"><span class="trade-idea-label">Action:</span> {idea["Type"]} ({idea["Date"]:%Y-%m-%d})</div>'
+            f'<div class="trade-idea-row"><span class="trade-idea-label">Entry Price:</span> {price_str}</div>'
+            f'<div class="trade-idea-row"><span class="trade-idea-label">Stop Loss:</span> {stop_str}</div>'
+            f'<div class="trade-idea-row"><span class="trade-idea-label">Take Profit:</span> {tp_str}</div>'
+            f'<div class="trade-idea-row"><span class="trade-idea-label">Current Price:</span> {curr_str}</div>'
+            f'<div class="trade-idea-row"><span class="trade-idea-label">Performance:</span> <span class="{perf_class}">{perf_str}</span></div>'
+            f'<div class="trade-idea-row"><span class="trade-idea-label">Status:</span> {status_str}</div>'
+            f'{sparkline_img}'
+            f'</div>'
+        )
+
+    st.markdown(f"""
 <div class="trade-ideas-row-center">
 {trade_ideas_boxes_html}
 </div>
 """, unsafe_allow_html=True)
 
-# --- DATA PREPARATION (MUST BE BEFORE LAYOUT) ---
-# Calculate the target "last Friday" date
-today = date.today()
-if today.weekday() >= 4: # Friday, Saturday, Sunday
-    days_to_subtract = today.weekday() - 4
-else: # Monday, Tuesday, Wednesday, Thursday
-    days_to_subtract = today.weekday() + 3
-target_friday_date = today - timedelta(days=days_to_subtract)
-target_friday_ts = pd.Timestamp(target_friday_date)
-
-start_download_date = target_friday_ts - pd.Timedelta(days=15)
-end_download_date = target_friday_ts + pd.Timedelta(days=1)
-
-try:
-    hist_data_all_fields = yf.download(tickers, start=start_download_date, end=end_download_date, progress=False, auto_adjust=False)
-    if hist_data_all_fields.empty:
-        st.error(f"No historical data downloaded for the period around {target_friday_ts.strftime('%Y-%m-%d') }.")
-        st.stop()
-    close_prices_hist = hist_data_all_fields['Close']
-    if isinstance(close_prices_hist, pd.Series):
-        close_prices_hist = close_prices_hist.to_frame(name=tickers[0] if len(tickers) == 1 else 'Close')
-        if len(tickers) == 1 :
-             pass
-        elif 'Close' in close_prices_hist.columns and len(tickers) >1 :
-             st.warning("Unexpected data structure for close_prices_hist from yfinance.")
-except Exception as e:
-    st.error(f"Error downloading data from Yahoo Finance: {e}")
-    st.stop()
-
-df_idx = close_prices_hist.index
-if not isinstance(df_idx, pd.DatetimeIndex):
-    close_prices_hist.index = pd.to_datetime(close_prices_hist.index)
-
-dates_before_today = close_prices_hist.index[close_prices_hist.index < pd.Timestamp.today().normalize()]
-if len(dates_before_today) == 0:
-    st.error(f"No trading data found before today.")
-    st.stop()
-last_trading_day = dates_before_today[-1]
-
-last_day_closes = close_prices_hist.loc[last_trading_day]
-df_display = pd.DataFrame(index=last_day_closes.index)
-df_display['Ticker'] = df_display.index
-df_display['Company Name'] = df_display['Ticker'].map(company_names)
-df_display[f'Close ({last_trading_day.strftime("%Y-%m-%d")})'] = last_day_closes
-
-dates_before_last = close_prices_hist.index[close_prices_hist.index < last_trading_day]
-if len(dates_before_last) == 0:
-    prev_trading_day = None
-else:
-    prev_trading_day = dates_before_last[-1]
-
-if prev_trading_day is not None:
-    prev_day_closes = close_prices_hist.loc[prev_trading_day]
-    df_display['% Change'] = ((df_display[f'Close ({last_trading_day.strftime("%Y-%m-%d")})'] - prev_day_closes) / prev_day_closes) * 100
-else:
-    df_display['% Change'] = float('nan')
-
-def color_pnl(val):
+# --- LOCAL OHLCV BAR STORE ---
+# One memory-mapped .npy partition per (interval, ticker). Each sync only asks
+# Yahoo for the tail that is missing on disk, so warm reruns stay offline.
+BAR_STORE_DIR = os.path.join(DATA_DIR, "bars")
+BAR_FIELDS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+BAR_DTYPE = np.dtype([('ts', '<i8')] + [(f, '<f8') for f in BAR_FIELDS])
+BAR_RECHECK_SECONDS = 3600
+bar_store_stats = process_counters("bar_store", ("downloads", "symbols_downloaded", "symbols_from_disk"))
+
+def _bar_path(ticker, interval):
+    return os.path.join(BAR_STORE_DIR, interval, f"{ticker.replace('/', '_')}.npy")
+
+def _bar_meta_path(interval):
+    return os.path.join(BAR_STORE_DIR, interval, "_meta.json")
+
+def read_bars(ticker, interval="1d"):
+    path = _bar_path(ticker, interval)
+    if not os.path.exists(path):
+        return np.empty(0, dtype=BAR_DTYPE)
+    return np.load(path, mmap_mode='r')
+
+def write_bars(ticker, interval, new_bars):
+    existing = read_bars(ticker, interval)
+    if len(existing) and len(new_bars):
+        # The re-downloaded tail replaces whatever overlaps it on disk (e.g. a partial last bar)
+        merged = np.concatenate([np.asarray(existing[existing['ts'] < new_bars['ts'][0]]), new_bars])
+    else:
+        merged = new_bars if len(new_bars) else np.asarray(existing)
+    path = _bar_path(ticker, interval)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, merged)
+    os.replace(tmp_path, path)
+
+def _load_bar_meta(interval):
     try:
-        v = float(val)
-        if v > 0:
-            return 'color: #188038; font-weight: bold;'
-        elif v < 0:
-            return 'color: #d93025; font-weight: bold;'
-    except:
-        pass
-    return ''
-
-def fetch_ticker_data(ticker_symbol, last_official_close):
+        with open(_bar_meta_path(interval)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_bar_meta(interval, meta):
+    path = _bar_meta_path(interval)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(meta, f)
+    os.replace(path + ".tmp", path)
+
+def _frame_to_bars(frame):
+    frame = frame.dropna(subset=['Close'])
+    index = frame.index.tz_localize(None) if frame.index.tz is not None else frame.index
+    bars = np.empty(len(frame), dtype=BAR_DTYPE)
+    bars['ts'] = index.values.astype('datetime64[ns]').astype('i8')
+    for field in BAR_FIELDS:
+        bars[field] = frame[field].to_numpy(dtype=float) if field in frame else np.nan
+    return bars
+
+def _ticker_frame(data, ticker):
+    if not isinstance(data.columns, pd.MultiIndex):
+        return data
+    if ticker not in data.columns.get_level_values(1):
+        return pd.DataFrame(columns=BAR_FIELDS)
+    return data.xs(ticker, axis=1, level=1)
+
+@st.cache_resource
+def _bar_store_lock():
+    return threading.Lock()
+
+def sync_bar_store(symbols, start, end, interval="1d"):
+    # Loaders prefetch side by side on the I/O loop; syncs are serialized so two of
+    # them never rewrite the same .npy/meta file (the second one then hits disk)
+    with _bar_store_lock():
+        _sync_bar_store(symbols, start, end, interval)
+
+def _bar_meta_entry(meta, ticker):
+    # {"checked": last sync time, "start": earliest requested start the bars on disk cover}
+    entry = meta.get(ticker, {})
+    return entry if isinstance(entry, dict) else {"checked": entry}
+
+def _sync_bar_store(symbols, start, end, interval):
+    meta = _load_bar_meta(interval)
+    now = time.time()
+    fetch_groups = {}
+    for t in symbols:
+        bars = read_bars(t, interval)
+        entry = _bar_meta_entry(meta, t)
+        covered_from = min(entry.get("start", np.inf), bars['ts'][0] if len(bars) else np.inf)
+        # Coverage comes first: a recent sync of a shorter window doesn't cover an older start
+        if covered_from > start.value:
+            fetch_groups.setdefault(start, []).append(t)
+            continue
+        checked = entry.get("checked", 0)
+        if now - checked < BAR_RECHECK_SECONDS:
+            bar_store_stats["symbols_from_disk"] += 1
+            continue
+        if len(bars) == 0:
+            fetch_groups.setdefault(start, []).append(t)
+            continue
+        last_bar = pd.Timestamp(bars['ts'][-1])
+        # A bar is final once it was fetched on a later day than its own date
+        last_bar_final = last_bar.normalize() < pd.Timestamp(checked, unit='s').normalize()
+        # A bar past the window (e.g. today's, written by a longer sync) means the window's bars are final too
+        if last_bar >= end - pd.Timedelta(days=1) and (last_bar_final or last_bar >= end):
+            bar_store_stats["symbols_from_disk"] += 1
+            continue
+        fetch_groups.setdefault(last_bar, []).append(t)
+    for fetch_start, group in ((start, chunk) for start, symbols in fetch_groups.items()
+                               for chunk in chunked(symbols, YAHOO_CHUNK_SIZE)):
+        if fetch_start >= end:
+            # Nothing left to ask for in this window; yfinance would still send the request
+            continue
+        bar_store_stats["downloads"] += 1
+        bar_store_stats["symbols_downloaded"] += len(group)
+        data = yf_download(group, start=fetch_start, end=end, interval=interval, group_by="column",
+                           progress=False, auto_adjust=False)
+        for t in group:
+            write_bars(t, interval, _frame_to_bars(_ticker_frame(data, t)))
+            entry = _bar_meta_entry(meta, t)
+            # The requested start is covered even when the first bar is later (weekend, listing date)
+            meta[t] = {"checked": now, "start": int(min(entry.get("start", np.inf), fetch_start.value))}
+    if fetch_groups:
+        _save_bar_meta(interval, meta)
+
+def load_bar_frame(symbols, start, end, field='Close', interval="1d"):
+    columns = {}
+    for t in symbols:
+        bars = read_bars(t, interval)
+        lo, hi = np.searchsorted(bars['ts'], [start.value, end.value])
+        columns[t] = pd.Series(np.array(bars[field][lo:hi]), index=pd.DatetimeIndex(bars['ts'][lo:hi]))
+    return pd.DataFrame(columns)
+
+@cached_loader("daily_history", ttl=3600)
+def load_daily_closes(symbols, start, end):
+    sync_bar_store(symbols, start, end)
+    return load_bar_frame(symbols, start, end)
+
+# --- SPARKLINE SERVICE ---
+# Sparklines are SVG polylines drawn from the bar store's daily closes. Rendered
+# SVG is memoized per (ticker, period, size, color) together with the last bar
+# time it was drawn from, so it is only redrawn when a new bar arrives.
+SPARKLINE_PERIODS = {"1mo": 31, "3mo": 92, "1y": 366}
+SPARKLINE_MAX_POINTS = 60
+
+@st.cache_resource
+def _sparkline_cache():
+    return {}
+
+def sparkline_window(period):
+    end = pd.Timestamp.today().normalize() + pd.Timedelta(days=1)
+    return end - pd.Timedelta(days=SPARKLINE_PERIODS[period]), end
+
+@cached_loader("sparkline_closes", ttl=3600)
+def load_sparkline_closes(symbols, period="1mo"):
+    start, end = sparkline_window(period)
+    sync_bar_store(symbols, start, end)
+    return load_bar_frame(symbols, start, end)
+
+def sparkline_points(symbols, period="1mo", max_points=SPARKLINE_MAX_POINTS):
+    # Decimated close lists, e.g. for st.column_config.LineChartColumn
+    closes = load_sparkline_closes(tuple(symbols), period)
+    points = {}
+    for t in symbols:
+        series = closes[t].dropna().to_numpy() if t in closes else np.empty(0)
+        points[t] = series[lttb(series, max_points)].round(4).tolist()
+    return points
+
+@traced("sparklines.render")
+def sparkline_svgs(symbols, period="1mo", width=350, height=90, color="#6ee26e", css_class=None):
+    closes = load_sparkline_closes(tuple(symbols), period)
+    cache = _sparkline_cache()
+    svgs = {}
+    for t in symbols:
+        series = closes[t].dropna() if t in closes else pd.Series(dtype=float)
+        last_bar = series.index[-1] if len(series) else None
+        key = (t, period, width, height, color, css_class)
+        cached = cache.get(key)
+        if cached is None or cached[0] != last_bar:
+            cached = cache[key] = (last_bar, get_sparkline_svg(series.to_numpy(), width, height, color,
+                                                               max_points=SPARKLINE_MAX_POINTS, css_class=css_class))
+        svgs[t] = cached[1]
+    return svgs
+
+# --- BATCHED QUOTE ENGINE ---
+# One 3-day 1-minute prepost download for the whole watchlist; last price,
+# previous close, pre-market and after-hours prices are all derived from that
+# single frame. Three days so that during today's pre-market the frame still
+# holds two completed regular sessions.
+us_eastern = pytz.timezone('US/Eastern')
+quote_engine_stats = process_counters("quote_engine", ("batch_downloads", "symbols_requested", "share_lookups"))
+
+def download_quote_bars(symbols):
+    symbols = list(symbols)
+    quote_engine_stats["batch_downloads"] += 1
+    quote_engine_stats["symbols_requested"] += len(symbols)
+    bars = yf_download(symbols, period="3d", interval="1m", prepost=True, group_by="column",
+                       auto_adjust=False, progress=False, threads=True)
+    if bars.empty:
+        return pd.DataFrame(columns=symbols, dtype=float)
+    closes = bars['Close']
+    if isinstance(closes, pd.Series):
+        closes = closes.to_frame(name=symbols[0])
+    return closes.reindex(columns=symbols).astype(float)
+
+QUOTE_COLUMNS = ["Last Price", "Last Price % Change", "Pre-market Price", "Pre-market % Change", "Pre-market Time",
+                 "After-hours Price", "After-hours % Change", "After-hours Time"]
+
+def classify_sessions(index):
+    # One tz conversion for the whole index, then integer minute-of-day masks:
+    # pre 04:00-09:30, regular 09:30-16:00, post 16:00-20:00 US/Eastern
+    idx = index if index.tz is not None else index.tz_localize('UTC')
+    idx_et = idx.tz_convert(us_eastern)
+    minutes = np.asarray(idx_et.hour * 60 + idx_et.minute)
+    sessions = {
+        "pre": minutes < 9 * 60 + 30,
+        "regular": (minutes >= 9 * 60 + 30) & (minutes < 16 * 60),
+        "post": minutes >= 16 * 60,
+    }
+    return idx_et, sessions
+
+def last_in_session(closes, idx_et, mask):
+    # Latest non-NaN bar inside the mask for every column at once: (prices, ET timestamps)
+    values = closes.to_numpy(dtype=float)
+    valid = ~np.isnan(values) & mask[:, None]
+    last_pos = np.where(valid, np.arange(len(values))[:, None], -1).max(axis=0)
+    found = last_pos >= 0
+    pos = np.maximum(last_pos, 0)
+    prices = np.where(found, values[pos, np.arange(values.shape[1])], np.nan)
+    times = pd.Series(idx_et[pos], index=closes.columns).where(found)
+    return pd.Series(prices, index=closes.columns), times
+
+def close_before(daily, times):
+    # Latest regular close strictly before each column's ET date in `times` (NaN where there is none)
+    filled = daily.ffill().to_numpy(dtype=float)
+    days = pd.DatetimeIndex(times).normalize()
+    pos = daily.index.searchsorted(days, side='left') - 1
+    valid = (pos >= 0) & ~days.isna()
+    values = np.where(valid, filled[np.maximum(pos, 0), np.arange(len(times))], np.nan)
+    return pd.Series(values, index=times.index)
+
+def close_on(daily, times):
+    # Regular close of each column's own ET date in `times` (NaN if it had no regular session)
+    days = pd.DatetimeIndex(times).normalize()
+    pos = daily.index.searchsorted(days, side='right') - 1
+    valid = (pos >= 0) & ~days.isna()
+    valid &= daily.index[np.maximum(pos, 0)] == days
+    values = np.where(valid, daily.to_numpy(dtype=float)[np.maximum(pos, 0), np.arange(len(times))], np.nan)
+    return pd.Series(values, index=times.index)
+
+def compute_quotes(closes):
+    quotes = pd.DataFrame(index=closes.columns)
+    if closes.empty:
+        for col in QUOTE_COLUMNS:
+            quotes[col] = np.nan
+        return quotes
+    idx_et, sessions = classify_sessions(closes.index)
+    regular = sessions["regular"]
+    # Regular-session closes per ET day; the previous close is the one before each symbol's latest session
+    daily = closes[regular].groupby(idx_et.normalize()[regular]).last()
+    last_price, last_time = last_in_session(closes, idx_et, regular)
+    prev_close = close_before(daily, last_time)
+    prev_close = prev_close.where(prev_close != 0)
+    pre_price, pre_time = last_in_session(closes, idx_et, sessions["pre"])
+    post_price, post_time = last_in_session(closes, idx_et, sessions["post"])
+    quotes["Last Price"] = last_price
+    quotes["Last Price % Change"] = (last_price - prev_close) / prev_close * 100
+    quotes["Pre-market Price"] = pre_price
+    # Pre-market trades against the regular close before its own day, whichever day that is
+    pre_reference = close_before(daily, pre_time)
+    pre_reference = pre_reference.where(pre_reference != 0)
+    quotes["Pre-market % Change"] = (pre_price - pre_reference) / pre_reference * 100
+    quotes["Pre-market Time"] = pre_time
+    # After-hours trades against the regular close of its own day; once a newer regular
+    # session has started the previous evening's after-hours no longer applies
+    current = pd.DatetimeIndex(post_time).normalize() >= pd.DatetimeIndex(last_time).normalize()
+    post_reference = close_on(daily, post_time).where(current)
+    post_reference = post_reference.where(post_reference != 0)
+    quotes["After-hours Price"] = post_price.where(current)
+    quotes["After-hours % Change"] = (post_price - post_reference) / post_reference * 100
+    quotes["After-hours Time"] = post_time.where(current)
+    return quotes
+
+@cached_loader("shares_outstanding", ttl=24 * 3600)
+def get_shares_outstanding(ticker_symbol):
+    # Shares outstanding barely moves, so market cap is derived from it and the last price
+    import yfinance as yf
+    quote_engine_stats["share_lookups"] += 1
+    # Failures propagate, so neither the loader cache nor the shares index keeps them for a day
+    with upstream(YAHOO_API_HOST):
+        return yf.Ticker(ticker_symbol).fast_info.get('shares', None)
+
+# Shares outstanding is looked up in the background a few symbols at a time, so
+# a watchlist of thousands doesn't hold up quotes (or the I/O pool); market caps
+# fill in as lookups land. Small batches are still waited for inline. A failed
+# lookup is retried after SHARES_FAILURE_TTL instead of waiting out SHARES_TTL.
+SHARES_TTL = 24 * 3600
+SHARES_FAILURE_TTL = 300
+SHARES_LOOKUP_CONCURRENCY = 4
+SHARES_INLINE_MAX = 50
+
+@st.cache_resource
+def _shares_index():
+    return {"values": {}, "pending": set(), "lock": threading.Lock()}
+
+async def _lookup_shares(symbols):
+    index = _shares_index()
+    for chunk in chunked(symbols, SHARES_LOOKUP_CONCURRENCY):
+        io_loop = get_io_loop()
+        results = await asyncio.gather(*(asyncio.wrap_future(io_loop.submit_blocking(get_shares_outstanding, s))
+                                         for s in chunk), return_exceptions=True)
+        with index["lock"]:
+            for symbol, shares in zip(chunk, results):
+                # values hold (shares, expires_at)
+                if isinstance(shares, Exception):
+                    print(f"Error for {symbol}: {shares}")
+                    previous = index["values"].get(symbol, (None,))[0]
+                    index["values"][symbol] = (previous, time.time() + SHARES_FAILURE_TTL)
+                else:
+                    index["values"][symbol] = (shares, time.time() + SHARES_TTL)
+                index["pending"].discard(symbol)
+
+def known_shares(symbols):
+    index = _shares_index()
+    now = time.time()
+    with index["lock"]:
+        due = [s for s in symbols if s not in index["pending"] and now >= index["values"].get(s, (None, 0))[1]]
+        index["pending"].update(due)
+    if due:
+        lookup = get_io_loop().submit(_lookup_shares(due))
+        if len(due) <= SHARES_INLINE_MAX:
+            lookup.result()
+    values = index["values"]
+    return pd.Series([values.get(s, (None,))[0] for s in symbols], index=list(symbols), dtype=float)
+
+@traced("quotes.chunk")
+def quote_chunk(symbols):
+    return compute_quotes(download_quote_bars(symbols))
+
+@cached_loader("intraday_quotes", ttl=30)
+def fetch_watchlist_quotes(symbols):
+    # Chunks download side by side under the shared Yahoo limiter and are reduced
+    # to one quote row per symbol right away, so only a chunk of minute bars is in memory at a time
+    frames = get_io_loop().map_blocking(quote_chunk, chunked(symbols, YAHOO_CHUNK_SIZE))
+    quotes = pd.concat(frames) if frames else compute_quotes(pd.DataFrame(dtype=float))
+    quotes["Market Cap"] = known_shares(symbols) * quotes["Last Price"]
+    return quotes
+
+# --- DATA PREPARATION (MUST BE BEFORE LAYOUT) ---
+def get_history_window():
+    # Calculate the target "last Friday" date
+    today = date.today()
+    if today.weekday() >= 4: # Friday, Saturday, Sunday
+        days_to_subtract = today.weekday() - 4
+    else: # Monday, Tuesday, Wednesday, Thursday
+        days_to_subtract = today.weekday() + 3
+    target_friday_date = today - timedelta(days=days_to_subtract)
+    target_friday_ts = pd.Timestamp(target_friday_date)
+    return target_friday_ts - pd.Timedelta(days=15), target_friday_ts + pd.Timedelta(days=1), target_friday_ts
+
+# The watchlist frame stays typed end to end; display formats live in
+# WATCHLIST_COLUMN_CONFIG and are applied by st.dataframe at render time
+WATCHLIST_DTYPES = {
+    'Ticker': 'string',
+    'Company Name': 'string',
+    'Last Price': 'float32',
+    'Last Price % Change': 'float32',
+    'Pre-market Price': 'float32',
+    'Pre-market % Change': 'float32',
+    'After-hours Price': 'float32',
+    'After-hours % Change': 'float32',
+    'Market Cap': 'Int64',
+}
+WATCHLIST_CHANGE_COLUMNS = ['Last Price % Change', 'Pre-market % Change', 'After-hours % Change']
+
+def watchlist_quote_frame(symbols):
+    # Numeric quote rows for the whole watchlist; cheap even for thousands of symbols
+    quotes, _ = read_snapshot("watchlist_quotes")
+    missing = [s for s in symbols if quotes is None or s not in quotes.index]
+    if missing:
+        # Tickers added since the last snapshot are fetched now; the refresher picks them up next round
+        fresh = fetch_watchlist_quotes(tuple(missing))
+        quotes = fresh if quotes is None else pd.concat([quotes, fresh])
+    frame = quotes.reindex(symbols)
+    frame.insert(0, 'Ticker', frame.index)
+    return frame
+
+WATCHLIST_SORT_OPTIONS = ['Watchlist order', 'Ticker', 'Last Price', 'Last Price % Change', 'Pre-market % Change',
+                          'After-hours % Change', 'Market Cap']
+WATCHLIST_PAGE_SIZES = [25, 50, 100, 250]
+
+def watchlist_view():
+    # Sort/page settings from the widgets' state (the prefetch reads them before the widgets render)
+    state = st.session_state
+    return (state.get("watchlist_sort", WATCHLIST_SORT_OPTIONS[0]), state.get("watchlist_descending", False),
+            state.get("watchlist_page", 1), state.get("watchlist_page_size", WATCHLIST_PAGE_SIZES[1]))
+
+def sort_and_page(frame, sort_by, descending, page, page_size):
+    # Server-side sort over the numeric frame; only the returned page gets names, sparklines and formatting
+    if sort_by != 'Watchlist order':
+        frame = frame.sort_values(sort_by, ascending=not descending, na_position='last', kind='stable')
+    pages = max(1, -(-len(frame) // page_size))
+    page = min(max(page, 1), pages)
+    return frame.iloc[(page - 1) * page_size:page * page_size], pages
+
+def visible_watchlist_symbols():
+    sort_by, descending, page, page_size = watchlist_view()
+    page_frame, _ = sort_and_page(watchlist_quote_frame(get_watchlist()), sort_by, descending, page, page_size)
+    return list(page_frame.index)
+
+# Quotes for symbols on a page someone viewed in the last WATCHLIST_VISIBLE_TTL
+# seconds refresh every round; the rest of the watchlist only every
+# WATCHLIST_FULL_REFRESH seconds, so a large watchlist doesn't re-download in full each round
+WATCHLIST_FULL_REFRESH = int(os.environ.get("TRADEBOX_REFRESH_WATCHLIST_FULL", 300))
+WATCHLIST_VISIBLE_TTL = 120
+
+@st.cache_resource
+def _watchlist_refresh_state():
+    return {"lock": threading.Lock(), "visible": {}, "quotes": None, "full_at": 0.0}
+
+def mark_watchlist_visible(symbols):
+    state = _watchlist_refresh_state()
+    now = time.time()
+    with state["lock"]:
+        state["visible"].update(dict.fromkeys(symbols, now))
+
+def refresh_watchlist_quotes():
+    state = _watchlist_refresh_state()
+    watchlist = get_watchlist()
+    now = time.time()
+    with state["lock"]:
+        state["visible"] = {s: t for s, t in state["visible"].items() if now - t <= WATCHLIST_VISIBLE_TTL}
+        visible = set(state["visible"])
+    quotes = state["quotes"]
+    if quotes is None or now - state["full_at"] >= WATCHLIST_FULL_REFRESH:
+        quotes, state["full_at"] = fetch_watchlist_quotes(tuple(watchlist)), now
+    else:
+        hot = [s for s in watchlist if s in visible or s not in quotes.index]
+        if hot:
+            fresh = fetch_watchlist_quotes(tuple(hot))
+            quotes = pd.concat([quotes.drop(fresh.index, errors='ignore'), fresh])
+        quotes = quotes.reindex(watchlist)
+    state["quotes"] = quotes
+    return quotes
+
+def render_watchlist_controls(frame):
+    sort_col, dir_col, size_col, page_col = st.columns([3, 1, 1, 1])
+    sort_col.selectbox("Sort by", WATCHLIST_SORT_OPTIONS, key="watchlist_sort")
+    dir_col.toggle("Descending", key="watchlist_descending")
+    size_col.selectbox("Rows", WATCHLIST_PAGE_SIZES, index=1, key="watchlist_page_size")
+    sort_by, descending, page, page_size = watchlist_view()
+    pages = max(1, -(-len(frame) // page_size))
+    if page > pages:
+        st.session_state["watchlist_page"] = pages
+    page_col.number_input("Page", min_value=1, max_value=pages, step=1, key="watchlist_page")
+    page_frame, _ = sort_and_page(frame, sort_by, descending, st.session_state["watchlist_page"], page_size)
+    first = (st.session_state["watchlist_page"] - 1) * page_size
+    st.caption(f"Showing {first + 1 if len(frame) else 0}–{first + len(page_frame)} of {len(frame)} symbols")
+    return page_frame
+
+def get_watchlist_frame(page_frame):
+    symbols = list(page_frame.index)
+    start_download_date, end_download_date, target_friday_ts = get_history_window()
+
     try:
-        ticker_obj = yf.Ticker(ticker_symbol)
-        # Previous close: her zaman bir önceki günün kapanışı
-        daily_hist = ticker_obj.history(period="2d", interval="1d")['Close']
-        if len(daily_hist) >= 2:
-            prev_close = daily_hist.iloc[-2]
-        else:
-            prev_close = None
-        # Last price: gün içi son fiyat
-        hist = ticker_obj.history(period="1d", interval="1m")
-        last_price = hist['Close'].iloc[-1] if not hist.empty else None
-        if pd.notnull(last_price) and pd.notnull(prev_close) and prev_close != 0:
-            last_price_change = ((last_price - prev_close) / prev_close) * 100
-        else:
-            last_price_change = None
-        # Pre-market price: prepost ile alınan en son pre-market fiyat
-        us_eastern = pytz.timezone('US/Eastern')
-        pre_hist = ticker_obj.history(period="2d", interval="1m", prepost=True)
-        pre_market_price = None
-        pre_market_ts = None
-        if not pre_hist.empty:
-            for ts, row in pre_hist.iloc[::-1].iterrows():
-                ts_est = ts.tz_convert(us_eastern)
-                if ts_est.hour < 9 or (ts_est.hour == 9 and ts_est.minute < 30):
-                    pre_market_price = row['Close']
-                    pre_market_ts = ts_est
-                    break
-        if pre_market_price is not None and prev_close is not None and prev_close != 0:
-            pre_market_change = ((pre_market_price - prev_close) / prev_close) * 100
-        else:
-            pre_market_change = None
-        info = ticker_obj.fast_info
-        market_cap = info.get('marketCap', None)
-        pe = info.get('pe_ratio', None)
-        if pe is None:
-            try:
-                pe = ticker_obj.info.get('trailingPE', None)
-            except Exception:
-                pe = None
-        return {
-            "Ticker": ticker_symbol,
-            "Last Price": last_price,
-            "Last Price % Change": last_price_change,
-            "Pre-market Price": pre_market_price,
-            "Pre-market % Change": pre_market_change,
-            "Market Cap": market_cap,
-            "P/E Ratio": pe,
-        }
+        close_prices_hist = load_daily_closes(tuple(symbols), start_download_date, end_download_date)
+        if close_prices_hist.empty:
+            st.error(f"No historical data downloaded for the period around {target_friday_ts.strftime('%Y-%m-%d') }.")
+            return None
     except Exception as e:
-        print(f"Error for {ticker_symbol}: {e}")
-        return {
-            "Ticker": ticker_symbol,
-            "Last Price": None,
-            "Last Price % Change": None,
-            "Pre-market Price": None,
-            "Pre-market % Change": None,
-            "Market Cap": None,
-            "P/E Ratio": None,
-        }
+        st.error(f"Error downloading data from Yahoo Finance: {e}")
+        return None
 
-with ThreadPoolExecutor(max_workers=8) as executor:
-    results = list(executor.map(lambda t: fetch_ticker_data(t, last_official_close_dict.get(t)), df_display['Ticker']))
+    if not (pd.to_datetime(close_prices_hist.index) < pd.Timestamp.today().normalize()).any():
+        st.error(f"No trading data found before today.")
+        return None
 
-parallel_df = pd.DataFrame(results).set_index('Ticker')
-for col in parallel_df.columns:
-    df_display[col] = parallel_df[col]
-cols = ['Ticker', 'Company Name', 'Last Price', 'Last Price % Change', 'Pre-market Price', 'Pre-market % Change', 'Market Cap']
-df_display = df_display[cols]
-for col in df_display.columns:
-    try:
-        df_display[col] = pd.to_numeric(df_display[col])
-    except Exception:
-        pass
+    df_display = page_frame.assign(**{
+        'Company Name': page_frame['Ticker'].map(load_company_names(symbols)),
+        'Market Cap': page_frame['Market Cap'].round(),
+    })
+    df_display = df_display[list(WATCHLIST_DTYPES)].astype(WATCHLIST_DTYPES)
+    df_display['Trend (1mo)'] = df_display['Ticker'].map(sparkline_points(symbols))
+    return df_display
 
 # --- TABLE AND TRADE IDEAS LAYOUT ---
-col1, col2 = st.columns([4, 1])
-
-with col1:
-    now = time.strftime('%Y-%m-%d %H:%M:%S')
-    st.caption(f"Last data refresh: {now}")
-    def make_yahoo_link(val):
-        if pd.isnull(val):
-            return val
-        url = f'https://finance.yahoo.com/quote/{val}'
-        return f'{val}'  # st.dataframe HTML desteklemez, düz metin
-    def format_market_cap(val):
-        try:
-            val = float(val)
-            if val >= 1e9:
-                return f"{val/1e9:.1f}B"
-            elif val >= 1e6:
-                return f"{val/1e6:.1f}M"
-            else:
-                return f"{val:.0f}"
-        except:
-            return val
-    df_disp = df_display.copy()
-    df_disp['Ticker'] = df_disp['Ticker'].apply(make_yahoo_link)
-    df_disp['Pre-market Price'] = df_disp['Pre-market Price'].map(lambda x: f"{x:,.2f}" if pd.notnull(x) else "")
-    df_disp['Last Price'] = df_disp['Last Price'].map(lambda x: f"{x:,.2f}" if pd.notnull(x) else "")
-    df_disp['Market Cap'] = df_disp['Market Cap'].map(format_market_cap)
-    if 'Last Price % Change' in df_disp:
-        df_disp['Last Price % Change'] = df_disp['Last Price % Change'].map(lambda x: f"{float(x):+0.2f}%" if pd.notnull(x) else "")
-    if 'Pre-market % Change' in df_disp:
-        df_disp['Pre-market % Change'] = df_disp['Pre-market % Change'].map(lambda x: f"{float(x):+0.2f}%" if pd.notnull(x) else "")
-    if '% Change' in df_disp:
-        df_disp['% Change'] = df_disp['% Change'].map(lambda x: f"{float(x):+0.2f}%" if pd.notnull(x) else "")
-    # Index sütununu kaldır
-    df_disp = df_disp.reset_index(drop=True)
-    # Negatif/pozitif renklendirme için Styler kullan
-    def color_pnl(val):
-        try:
-            v = float(str(val).replace('%',''))
-            if v > 0:
-                return 'color: #188038; font-weight: bold;'
-            elif v < 0:
-                return 'color: #d93025; font-weight: bold;'
-        except:
-            pass
-        return ''
-    style_cols = [col for col in ['Last Price % Change', 'Pre-market % Change', '% Change'] if col in df_disp.columns]
-    styled = df_disp.style.map(color_pnl, subset=style_cols)
-    st.dataframe(styled, use_container_width=True, hide_index=True)
-
-# GOOGL ve Dow Jones veri kontrolü
-if 'GOOGL' in df_display.index and df_display.loc['GOOGL'].isnull().any():
-    st.warning("GOOGL verileri alınamadı.")
-if 'Dow Jones' in index_prices and index_prices.get('Dow Jones') is None:
-    st.warning("Dow Jones verisi alınamadı.")
+WATCHLIST_COLUMN_CONFIG = {
+    'Last Price': st.column_config.NumberColumn(format="%.2f"),
+    'Pre-market Price': st.column_config.NumberColumn(format="%.2f"),
+    'After-hours Price': st.column_config.NumberColumn(format="%.2f"),
+    **{col: st.column_config.NumberColumn(format="%+.2f%%") for col in WATCHLIST_CHANGE_COLUMNS},
+    'Market Cap': st.column_config.NumberColumn(format="compact"),
+    'Trend (1mo)': st.column_config.LineChartColumn("Trend (1mo)", width="small"),
+}
+
+@traced("render.watchlist_table")
+def render_watchlist_table(df_display):
+    col1, col2 = st.columns([4, 1])
+
+    with col1:
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        _, quotes_updated_at = read_snapshot("watchlist_quotes")
+        snapshot_age = f"{time.time() - quotes_updated_at:.0f}s" if quotes_updated_at else "n/a"
+        st.caption(f"Last data refresh: {now} · Quote snapshot age: {snapshot_age}")
+        st.caption(
+            f"Quote engine: {quote_engine_stats['batch_downloads']} batch download(s) for "
+            f"{quote_engine_stats['symbols_requested']} symbols, "
+            f"{quote_engine_stats['share_lookups']} share lookup(s) since server start"
+        )
+        st.caption(
+            f"Bar store: {bar_store_stats['downloads']} download(s) for "
+            f"{bar_store_stats['symbols_downloaded']} symbols, "
+            f"{bar_store_stats['symbols_from_disk']} served from disk since server start"
+        )
+        st.caption(
+            f"Name index: {name_index_stats['hits']} hit(s), {name_index_stats['scraped']} ticker(s) scraped, "
+            f"{name_index_stats['google_requests']} Google request(s), "
+            f"{name_index_stats['background_refreshes']} background refresh(es) since server start"
+        )
+        # Negatif/pozitif renklendirme için Styler kullan; sayı formatları column_config'den gelir
+        styled = style_pnl(df_display, WATCHLIST_CHANGE_COLUMNS)
+        st.dataframe(styled, use_container_width=True, hide_index=True, column_config=WATCHLIST_COLUMN_CONFIG)
+
+    # GOOGL ve Dow Jones veri kontrolü
+    # Session columns (pre-market / after-hours) are blank by design outside their session
+    if 'GOOGL' in df_display.index and df_display.loc['GOOGL', ['Last Price', 'Company Name']].isnull().any():
+        st.warning("GOOGL verileri alınamadı.")
 
 # --- TRADINGVIEW WIDGET (EMBED) ---
 tradingview_css = """
@@ -1194,7 +2744,8 @@ def get_tradingview_embed(symbol):
       <iframe src='https://s.tradingview.com/widgetembed/?symbol={symbol}&interval=15&theme=dark&style=1&locale=en&utm_source=localhost&utm_medium=widget&utm_campaign=chart&utm_term={symbol}' width='100%' height='420' frameborder='0' allowtransparency='true' scrolling='no' style='border-radius:10px;'></iframe>
     </div>
     """
-if selected_nav == "Home":
+
+def render_tradingview():
     st.markdown(tradingview_css, unsafe_allow_html=True)
     tv_symbol_labels = [s['label'] for s in tradingview_symbols]
     tv_symbol_map = {s['label']: s['value'] for s in tradingview_symbols}
@@ -1203,4 +2754,323 @@ if selected_nav == "Home":
     st.markdown(tv_embed_html, unsafe_allow_html=True)
 
 # --- CNN FEAR & GREED INDEX (MARKET SENTIMENT) ---
-# (Bu bölümü kaldırdım) 
\ No newline at end of file
+# (Bu bölümü kaldırdım) 
+
+# --- BACKGROUND REFRESHER ---
+# A single daemon thread per server keeps a shared snapshot warm; pages only
+# read the snapshot, so render time and upstream load don't depend on viewers.
+# Each kind runs on its own schedule: a due job starts on its own worker without
+# waiting for the others, so one slow source can't hold back the fast ones.
+# Viewers that arrive before a kind's first snapshot join the run in progress;
+# after a failure the kind backs off, so reruns don't retry upstream inline.
+REFRESH_INTERVALS = {
+    "watchlist_quotes": 30,
+    "index_snapshot": 60,
+    "etf_quotes": 60,
+    "movers": 300,
+    "trade_idea_prices": 30,
+    "news": 300,
+}
+for _kind in REFRESH_INTERVALS:
+    REFRESH_INTERVALS[_kind] = int(os.environ.get(f"TRADEBOX_REFRESH_{_kind.upper()}", REFRESH_INTERVALS[_kind]))
+REFRESH_RETRY_SECONDS = 5
+
+class BackgroundRefresher:
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.snapshot = {}
+        self._lock = threading.Lock()
+        self._next_run = {kind: 0 for kind in jobs}
+        self._failures = dict.fromkeys(jobs, 0)
+        # kind -> Future of the run in progress, shared by the thread and first viewers
+        self._running = {}
+        # One worker per kind, outside the I/O pools viewers wait in, so a waited-on run always gets a thread
+        self._workers = ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix="tradebox-refresh")
+        self._thread = threading.Thread(target=self._run, name="tradebox-refresher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _claim(self, kind):
+        # Called with the lock held; returns the run to wait on and whether the caller starts it
+        flight = self._running.get(kind)
+        if flight is not None:
+            return flight, False
+        flight = self._running[kind] = Future()
+        return flight, True
+
+    def _run(self):
+        while True:
+            with self._lock:
+                due = [kind for kind in self.jobs if kind not in self._running and time.time() >= self._next_run[kind]]
+                flights = [self._claim(kind)[0] for kind in due]
+            for kind, flight in zip(due, flights):
+                self._workers.submit(self._refresh_scheduled, kind, flight)
+            time.sleep(1)
+
+    def _refresh_scheduled(self, kind, flight):
+        # The workers stand in for pool level 0, so a job's own fan-out goes to level 1
+        _pool_level.set(0)
+        self._refresh_claimed(kind, flight)
+
+    def _refresh_claimed(self, kind, flight):
+        try:
+            self.refresh(kind)
+        finally:
+            with self._lock:
+                del self._running[kind]
+            flight.set_result(None)
+
+    def refresh(self, kind):
+        interval, fetch = self.jobs[kind]
+        try:
+            with trace_run(f"refresh:{kind}") as trace:
+                value = fetch()
+            _trace_log()["refreshes"][kind] = trace
+        except Exception as e:
+            print(f"Background refresh failed for {kind}: {e}")
+            # Retries back off from REFRESH_RETRY_SECONDS, doubling per failure up to the interval
+            self._failures[kind] += 1
+            self._next_run[kind] = time.time() + min(interval, REFRESH_RETRY_SECONDS * 2 ** (self._failures[kind] - 1))
+            return
+        with self._lock:
+            self.snapshot[kind] = (value, time.time())
+        if kind in LIVE_PUBLISHERS:
+            get_quote_feed().publish(LIVE_PUBLISHERS[kind](value))
+        self._failures[kind] = 0
+        self._next_run[kind] = time.time() + interval
+
+    def get(self, kind):
+        with self._lock:
+            entry = self.snapshot.get(kind)
+            if entry is not None:
+                return entry
+            # No snapshot yet: wait for a run in progress, or start one if the kind is due.
+            # While a failed kind backs off, viewers get no data instead of retrying upstream inline
+            if kind not in self._running and time.time() < self._next_run[kind]:
+                return None, None
+            flight, leader = self._claim(kind)
+        if leader:
+            self._refresh_claimed(kind, flight)
+        else:
+            flight.result()
+        with self._lock:
+            return self.snapshot.get(kind, (None, None))
+
+def _refresh_jobs():
+    return {
+        "watchlist_quotes": (REFRESH_INTERVALS["watchlist_quotes"], refresh_watchlist_quotes),
+        "index_snapshot": (REFRESH_INTERVALS["index_snapshot"], load_index_snapshot),
+        "etf_quotes": (REFRESH_INTERVALS["etf_quotes"], build_etf_table),
+        "movers": (REFRESH_INTERVALS["movers"], load_all_movers),
+        "trade_idea_prices": (REFRESH_INTERVALS["trade_idea_prices"],
+                              lambda: load_trade_idea_prices(trade_idea_tickers())),
+        "news": (REFRESH_INTERVALS["news"], lambda: load_news(tuple(get_watchlist()))),
+    }
+
+@st.cache_resource
+def get_background_refresher():
+    return BackgroundRefresher(_refresh_jobs()).start()
+
+def read_snapshot(kind):
+    with span(f"snapshot:{kind}"):
+        return get_background_refresher().get(kind)
+
+# --- LIVE QUOTES ---
+# Every refreshed quote table is published into one versioned feed. Only rows
+# whose values moved get a new version, so a live view asks for the rows of its
+# page changed since the version it last applied and patches just those.
+LIVE_COLUMNS = ["Last Price", "Last Price % Change", "Pre-market Price", "Pre-market % Change",
+                "After-hours Price", "After-hours % Change", "Market Cap"]
+LIVE_INTERVALS = [1, 2, 5, 10, 30]
+# "simulated" adds a local stand-in stream (random walk on a few symbols per tick) for demos and offline work
+LIVE_FEED = os.environ.get("TRADEBOX_LIVE_FEED", "snapshots")
+LIVE_PUBLISHERS = {
+    "watchlist_quotes": lambda quotes: quotes,
+    "trade_idea_prices": lambda prices: pd.DataFrame({"Last Price": pd.Series(prices, dtype=float)}),
+}
+
+class QuoteFeed:
+    def __init__(self):
+        self.version = 0
+        self.rows = pd.DataFrame(columns=LIVE_COLUMNS, dtype=float)
+        self.row_version = pd.Series(dtype='int64')
+        self._lock = threading.Lock()
+
+    def publish(self, quotes):
+        with self._lock:
+            old = self.rows.reindex(quotes.index)
+            # Columns a publisher doesn't carry keep their current values
+            incoming = pd.DataFrame({col: quotes[col] if col in quotes else old[col] for col in LIVE_COLUMNS},
+                                    index=quotes.index, dtype=float)
+            same = (incoming == old) | (incoming.isna() & old.isna())
+            changed = incoming.index[~same.all(axis=1).to_numpy()]
+            if len(changed) == 0:
+                return 0
+            self.version += 1
+            known = changed.intersection(self.rows.index)
+            self.rows.loc[known, LIVE_COLUMNS] = incoming.loc[known, LIVE_COLUMNS]
+            self.row_version.loc[known] = self.version
+            new = changed.difference(self.rows.index)
+            if len(new):
+                self.rows = pd.concat([self.rows, incoming.loc[new]])
+                self.row_version = pd.concat([self.row_version, pd.Series(self.version, index=new, dtype='int64')])
+            return len(changed)
+
+    def changes_since(self, version, symbols):
+        # Cost follows the page (symbols) and the changed rows, not the size of the feed
+        with self._lock:
+            row_version = self.row_version.reindex(symbols)
+            changed = row_version.index[(row_version > version).to_numpy()]
+            return self.version, self.rows.loc[changed].copy()
+
+class SimulatedQuoteSource:
+    def __init__(self, feed, symbols, tick=1.0, movers=5):
+        self.feed = feed
+        self.symbols = symbols
+        self.tick = tick
+        self.movers = movers
+        self._thread = threading.Thread(target=self._run, name="tradebox-simulated-feed", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        rng = np.random.default_rng()
+        while True:
+            time.sleep(self.tick)
+            symbols = self.symbols()
+            picks = list(rng.choice(symbols, min(self.movers, len(symbols)), replace=False))
+            _, held = self.feed.changes_since(-1, picks)
+            held = held.reindex(picks)
+            last = held["Last Price"].fillna(100.0)
+            prev_close = last / (1 + held["Last Price % Change"].fillna(0) / 100)
+            price = last * (1 + rng.normal(0, 0.002, len(picks)))
+            self.feed.publish(pd.DataFrame({
+                "Last Price": price,
+                "Last Price % Change": (price - prev_close) / prev_close * 100,
+                "Market Cap": held["Market Cap"] / last * price,
+            }, index=picks))
+
+@st.cache_resource
+def get_quote_feed():
+    feed = QuoteFeed()
+    if LIVE_FEED == "simulated":
+        SimulatedQuoteSource(feed, lambda: get_watchlist() + list(trade_idea_tickers())).start()
+    return feed
+
+def live_interval():
+    return st.session_state.get("live_interval", 5) if st.session_state.get("live_mode") else None
+
+def render_live_controls():
+    st.sidebar.toggle("Live mode", key="live_mode", help="Update quotes in place without reloading the page")
+    if st.session_state.get("live_mode"):
+        st.sidebar.select_slider("Live update every (s)", LIVE_INTERVALS, value=5, key="live_interval")
+
+def live_fragment(render, *args):
+    # In live mode this part of the page reruns on its own timer; otherwise it renders once per full run
+    st.fragment(render, run_every=live_interval())(*args)
+
+def reset_live_table(df_display):
+    # Called on full runs: the freshly built page becomes the base the deltas are applied to
+    if live_interval():
+        df_display.insert(df_display.columns.get_loc('Last Price') + 1, 'Tick', '')
+    st.session_state["live_table"] = df_display
+    st.session_state["live_version"] = 0
+
+def apply_quote_deltas(table, rows):
+    previous = table.loc[rows.index, 'Last Price'].to_numpy()
+    for col in LIVE_COLUMNS:
+        if col in table.columns:
+            values = rows[col].round() if col == 'Market Cap' else rows[col]
+            table.loc[rows.index, col] = values.astype(table[col].dtype)
+    if 'Tick' in table.columns:
+        # Compared at the table's precision so a float32 round trip doesn't show up as a tick
+        direction = np.sign(table.loc[rows.index, 'Last Price'].to_numpy() - previous)
+        table['Tick'] = ''
+        table.loc[rows.index, 'Tick'] = np.select([direction > 0, direction < 0], ['▲', '▼'], '')
+
+def render_live_watchlist():
+    table = st.session_state["live_table"]
+    mark_watchlist_visible(table.index)
+    version, rows = get_quote_feed().changes_since(st.session_state["live_version"], table.index)
+    if len(rows):
+        apply_quote_deltas(table, rows)
+    st.session_state["live_version"] = version
+    render_watchlist_table(table)
+
+def live_prices(symbols):
+    _, rows = get_quote_feed().changes_since(-1, symbols)
+    return rows["Last Price"].dropna().to_dict()
+
+# --- SAYFALAR ---
+# Loader calls each page (and the shared header) needs; they are started together
+# on the I/O loop before rendering, so the page waits for the slowest source only.
+def home_loaders():
+    start, end, _ = get_history_window()
+    # Only the watchlist page that is about to be shown is prefetched
+    visible = tuple(visible_watchlist_symbols())
+    return [
+        (load_company_names, visible),
+        (load_daily_closes, visible, start, end),
+        (read_snapshot, "trade_idea_prices"),
+        (load_trade_idea_bars, trade_idea_tickers(), *trade_idea_window(get_trade_ideas())),
+        (load_sparkline_closes, visible, "1mo"),
+    ]
+
+PAGE_LOADERS = {
+    "Home": home_loaders,
+    "Market Movers": lambda: [(read_snapshot, "movers")],
+    "News": lambda: [(load_news, tuple(get_watchlist()))],
+    "ETFs": lambda: [(read_snapshot, "etf_quotes")],
+    "Stock Heatmap": lambda: [],
+}
+HEADER_LOADERS = [(read_snapshot, "index_snapshot")]
+
+def render_home():
+    live_fragment(render_trade_ideas)
+    symbols = get_watchlist()
+    render_watchlist_editor(symbols)
+    page_frame = render_watchlist_controls(watchlist_quote_frame(symbols))
+    mark_watchlist_visible(page_frame.index)
+    df_display = get_watchlist_frame(page_frame)
+    if df_display is not None:
+        reset_live_table(df_display)
+        live_fragment(render_live_watchlist)
+    render_tradingview()
+    # En alta heatmap başlığı ve kutuları ekle
+    render_sector_heatmap()
+
+PAGES = {
+    "Home": render_home,
+    "Market Movers": render_market_movers,
+    "News": render_news,
+    "ETFs": render_etfs,
+    "Stock Heatmap": render_stock_heatmap,
+}
+
+def main():
+    st.set_page_config(page_title="Tradebox Stock Tracker", layout="wide")
+    with trace_run("rerun") as trace:
+        render_header()
+        render_live_controls()
+        # --- NAVBAR: StockCore altına ---
+        navbar_options = list(PAGES)
+        selected_nav = st.radio("", navbar_options, horizontal=True, label_visibility="collapsed")
+        trace.name = f"rerun:{selected_nav}"
+        with span("prefetch"):
+            get_io_loop().wait_all(HEADER_LOADERS + PAGE_LOADERS[selected_nav]())
+        # Ortak başlık widget'ları: ekonomik takvim + VIX ve endeks bandı
+        with span("header"):
+            render_econ_banner()
+            live_fragment(render_ticker_tape)
+        with span(f"page:{selected_nav}"):
+            PAGES[selected_nav]()
+    render_cache_status_panel()
+    render_upstream_panel()
+    render_performance_panel(trace)
+
+if __name__ == "__main__":
+    main()